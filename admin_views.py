@@ -0,0 +1,362 @@
+"""Admin pages: dashboard, students, attendance, payments, tariffs and diagnostics."""
+from datetime import datetime, date, timedelta
+
+from flask import Blueprint, Response, current_app, render_template, request, redirect, url_for, flash, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy.exc import OperationalError
+
+from models import db, User, Meal, Payment, StudentLedger, MonthlyCollection, BalanceCheckpoint, MealArchive, PaymentArchive, Tariff
+from ledger import ensure_ledger, apply_payment, apply_collection, remove_student_collections, rebuild_ledgers
+from pagination import paginate, page_args, filter_students
+from user_cache import user_cache
+import archive
+import attendance
+import attendance_events
+import database
+import headcounts
+import metrics
+import report_cache
+import stats_cache
+import tariffs
+
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+def dashboard_stats(today):
+    # Today's meal counts come from the daily headcount rollup
+    breakfast_count, lunch_count, dinner_count = headcounts.for_day(today)
+    
+    # Calculate total payments from the monthly rollup, which also covers archived payments
+    total_payments = db.session.query(db.func.sum(MonthlyCollection.total_amount)).scalar() or 0
+    
+    #Calculate total
+    total_students = User.query.filter_by(role='student').count()
+    
+    # Total dues come straight from the ledger: only negative balances (money owed by the student) count
+    total_dues = -(db.session.query(db.func.sum(StudentLedger.balance))
+                   .filter(StudentLedger.balance < 0).scalar() or 0)
+
+    return {
+        'breakfast_count': breakfast_count,
+        'lunch_count': lunch_count,
+        'dinner_count': dinner_count,
+        'total_students': total_students,
+        'total_payments': total_payments,
+        'total_dues': total_dues,
+        # Last 30 complete days and the week ahead, for the dashboard chart
+        'trend': headcounts.trend(today - timedelta(days=1), 30, 7, current_app.config['FORECAST_TREND_WINDOW']),
+    }
+
+@bp.route('/dashboard')
+@login_required
+def dashboard():
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('auth.login'))
+    
+    # Served from the statistics cache, which is cleared by any commit touching meals, payments or users
+    today = date.today()
+    stats = stats_cache.get_or_compute(f'admin_dashboard:{today.isoformat()}',
+                                       lambda: dashboard_stats(today))
+    return render_template('admin/dashboard.html', **stats)
+
+@bp.route('/headcounts/forecast')
+@login_required
+def headcount_forecast():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+    try:
+        history = int(request.args.get('history', 30))
+        days = int(request.args.get('days', 7))
+    except ValueError:
+        return jsonify({'error': 'history and days must be whole numbers'}), 400
+    if not 7 <= history <= current_app.config['HEADCOUNT_HISTORY_MAX_DAYS'] or not 1 <= days <= current_app.config['FORECAST_MAX_DAYS']:
+        return jsonify({'error': f"history must be 7-{current_app.config['HEADCOUNT_HISTORY_MAX_DAYS']} days "
+                                 f"and days 1-{current_app.config['FORECAST_MAX_DAYS']}"}), 400
+
+    # History runs to yesterday, the last complete day; the forecast starts today
+    today = date.today()
+    trend = stats_cache.get_or_compute(
+        f'headcount_forecast:{today.isoformat()}:{history}:{days}',
+        lambda: headcounts.trend(today - timedelta(days=1), history, days, current_app.config['FORECAST_TREND_WINDOW']))
+    return jsonify(trend)
+
+
+
+@bp.route('/students', methods=['GET', 'POST'])
+@login_required
+def students():
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+
+    if request.method == 'POST':
+        # Check if the request is for deletion
+        if 'delete' in request.form:
+            student_id = request.form.get('student_id')
+            student = User.query.get(student_id)
+            if student:
+                # Delete related meals, payments and ledger first to avoid integrity errors
+                headcounts.remove_student(student.id)
+                Meal.query.filter_by(student_id=student.id).delete()
+                MealArchive.query.filter_by(student_id=student.id).delete()
+                remove_student_collections(student.id)
+                Payment.query.filter_by(student_id=student.id).delete()
+                PaymentArchive.query.filter_by(student_id=student.id).delete()
+                StudentLedger.query.filter_by(student_id=student.id).delete()
+                BalanceCheckpoint.query.filter_by(student_id=student.id).delete()
+                db.session.delete(student)
+                db.session.commit()
+                user_cache.invalidate(student.id)
+                flash(f"Student {student.name} deleted successfully.", 'success')
+            else:
+                flash("Student not found.", 'danger')
+        else: # This is an add or edit request
+            student_id = request.form.get('student_id')
+            username = request.form['username']
+            name = request.form['name']
+            roll_no = request.form['roll_no']
+            room_no = request.form['room_no']
+            contact = request.form['contact']
+            password = request.form['password']
+
+            if student_id:
+                # This is an edit operation
+                student = User.query.get(student_id)
+                if student:
+                    student.username = username
+                    student.name = name
+                    student.roll_no = roll_no
+                    student.room_no = room_no
+                    student.contact = contact
+                    if password:
+                        student.set_password(password)
+                    db.session.commit()
+                    user_cache.invalidate(student.id)
+                    flash('Student updated successfully!', 'success')
+                else:
+                    flash('Student not found!', 'danger')
+            else:
+                # This is a create operation
+                new_student = User(username=username, name=name, roll_no=roll_no, room_no=room_no, contact=contact, role='student')
+                new_student.set_password(password)
+                db.session.add(new_student)
+                db.session.flush()
+                ensure_ledger(new_student.id)
+                db.session.commit()
+                flash('Student added successfully!', 'success')
+
+    search = request.args.get('q', '')
+    sort = request.args.get('sort', 'name')
+    if sort not in ('name', 'roll_no', 'room_no'):
+        sort = 'name'
+    per_page, after, before = page_args()
+
+    query = filter_students(User.query.filter_by(role='student'), search)
+    students = paginate(query, [getattr(User, sort), User.id], per_page, after, before,
+                        key=lambda student: [getattr(student, sort), student.id])
+    return render_template('admin/students.html', students=students, search=search, sort=sort)
+@bp.route('/students/import', methods=['POST'])
+@login_required
+def students_import():
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Choose a CSV file to import.', 'danger')
+        return redirect(url_for('admin.students'))
+
+    try:
+        import student_import  # only loaded by the first import
+
+        results = student_import.import_students(upload.stream,
+                                                 batch_size=current_app.config['IMPORT_BATCH_SIZE'],
+                                                 workers=current_app.config['IMPORT_HASH_WORKERS'],
+                                                 max_rows=current_app.config['IMPORT_MAX_ROWS'])
+    except student_import.CSVImportError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin.students'))
+
+    imported = sum(1 for result in results if result['success'])
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'imported': imported, 'failed': len(results) - imported, 'results': results})
+    return render_template('admin/import_report.html', results=results, imported=imported)
+
+@bp.route('/attendance', methods=['GET', 'POST'], endpoint='attendance')
+@login_required
+def attendance_page():
+    if current_user.role != 'admin':
+        return redirect(url_for('student.dashboard'))
+    
+    selected_date = request.args.get('date', date.today().isoformat())
+    
+    if request.method == 'POST':
+        # Use get() method to avoid KeyError
+        student_id = request.form.get('student_id')
+        meal_type = request.form.get('meal_type')
+        action = request.form.get('action')  # mark or unmark
+
+        if not all([student_id, meal_type, action]):
+            return jsonify({'success': False, 'error': 'Missing parameters'})
+
+        [result] = attendance.apply_changes([{
+            'student_id': student_id,
+            'date': request.form.get('date', selected_date),
+            'meal_type': meal_type,
+            'action': action,
+        }])
+        return jsonify(result)
+    
+    # Convert selected_date string to date object for querying
+    try:
+        selected_date_obj = datetime.strptime(selected_date, '%Y-%m-%d').date()
+    except ValueError:
+        selected_date_obj = date.today()
+    
+    # Taken before the queries, so a change committed in between is replayed by the stream
+    last_event_id = attendance_events.last_id()
+    students = User.query.filter_by(role='student').all()
+    # Closed dates may have been moved to the archive table; they are shown read-only
+    closed = archive.closed_through()
+    meals = archive.meal_entity(selected_date_obj)
+    rows = db.session.query(meals.student_id, meals.breakfast, meals.lunch, meals.dinner)\
+                     .filter(meals.date == selected_date_obj).all()
+    
+    # Create a dictionary for quick lookup
+    meal_dict = {row.student_id: row for row in rows}
+    
+    return render_template('admin/attendance.html', 
+                         students=students, 
+                         meal_dict=meal_dict,
+                         selected_date=selected_date,
+                         closed_through=closed if closed is not None and selected_date_obj <= closed else None,
+                         last_event_id=last_event_id)
+
+@bp.route('/attendance/stream')
+@login_required
+def attendance_stream():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+    try:
+        day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date().isoformat()
+        # EventSource sends Last-Event-ID when it reconnects; the page passes the id it was rendered at
+        after = attendance_events.cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    except ValueError:
+        return jsonify({'error': 'Expected date=YYYY-MM-DD and an event id'}), 400
+
+    response = Response(attendance_events.stream(day, after), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@bp.route('/attendance/bulk', methods=['POST'])
+@login_required
+def attendance_bulk():
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'error': 'Permission denied'}), 403
+
+    payload = request.get_json(silent=True) or {}
+    changes = payload.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'success': False, 'error': 'Expected a non-empty list of changes'}), 400
+    if len(changes) > current_app.config['ATTENDANCE_BULK_LIMIT']:
+        return jsonify({'success': False, 'error': 'Too many changes in one request'}), 413
+
+    results = attendance.apply_changes(changes)
+    return jsonify({'success': all(r['success'] for r in results), 'results': results})
+
+@bp.route('/payments', methods=['GET', 'POST'])
+@login_required
+def payments():
+    if current_user.role != 'admin':
+        return redirect(url_for('student.dashboard'))
+    
+    if request.method == 'POST':
+        roll_no = request.form['roll_no'].strip()
+        amount = request.form['amount']
+        
+        student = User.query.filter_by(role='student', roll_no=roll_no).first()
+        if student:
+            student_id = student.id
+
+            def record_payment():
+                payment = Payment(
+                    student_id=student_id,
+                    amount=float(amount),
+                    date=date.today(),
+                    status='paid'
+                )
+                db.session.add(payment)
+                apply_payment(student_id, payment.amount)
+                apply_collection(payment.date, payment.amount)
+                db.session.commit()
+
+            try:
+                database.with_retry(record_payment)
+                flash('Payment recorded successfully')
+            except OperationalError:
+                flash('The database is busy. Please try again.')
+        else:
+            flash(f'No student with roll number {roll_no}')
+    
+    search = request.args.get('q', '')
+    sort = request.args.get('sort', 'date')
+    if sort not in ('date', 'amount'):
+        sort = 'date'
+    per_page, after, before = page_args()
+
+    # Join the student in the same query instead of lazy-loading it per row
+    query = filter_students(Payment.query.join(Payment.student), search)\
+                .options(db.contains_eager(Payment.student))
+    sort_column = getattr(Payment, sort)
+    payments = paginate(query, [sort_column, Payment.id], per_page, after, before, descending=True,
+                        key=lambda payment: [getattr(payment, sort), payment.id])
+    return render_template('admin/payments.html', payments=payments, search=search, sort=sort)
+
+
+@bp.route('/tariffs', methods=['GET', 'POST'], endpoint='tariffs')
+@login_required
+def tariffs_page():
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+
+    if request.method == 'POST':
+        try:
+            effective_from = datetime.strptime(request.form['effective_from'], '%Y-%m-%d').date()
+            tariffs.set_rate(request.form['meal_type'], float(request.form['rate']), effective_from)
+            # The new rate may reprice meals already recorded; rebuild_ledgers commits both together
+            rebuild_ledgers()
+            flash('Rate saved')
+        except ValueError as e:
+            db.session.rollback()
+            tariffs.invalidate()
+            flash(str(e))
+        return redirect(url_for('admin.tariffs'))
+
+    rates = Tariff.query.order_by(Tariff.effective_from.desc(), Tariff.meal_type).all()
+    return render_template('admin/tariffs.html', tariffs=rates, default_rate=current_app.config['MEAL_COST'])
+
+
+@bp.route('/cache/stats')
+@login_required
+def cache_stats():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+    return jsonify({'user_cache': user_cache.stats(), 'report_cache': report_cache.stats()})
+
+@bp.route('/metrics', endpoint='metrics')
+@login_required
+def metrics_page():
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+    endpoints = metrics.summary()
+    startup = current_app.extensions.get('startup')
+    if request.args.get('format') == 'json':
+        return jsonify({'endpoints': endpoints, 'buckets': metrics.bucket_labels(), 'startup': startup})
+    return render_template('admin/metrics.html', endpoints=endpoints, buckets=metrics.bucket_labels(),
+                           threshold=current_app.config['METRICS_N_PLUS_ONE_THRESHOLD'], startup=startup)
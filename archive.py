@@ -0,0 +1,125 @@
+"""Balance checkpoints and archival of old meal and payment rows.
+
+A checkpoint records every student's cumulative meals, dues and payments up
+to a closing date (dues priced at the tariffs in force on each day), so balances can start from it instead of rescanning all
+history. Once a checkpoint exists, ``archive_closed_rows`` moves the Meal
+and Payment rows it covers into MealArchive and PaymentArchive, keeping the
+live tables small. Days up to the latest checkpoint are closed for
+attendance changes.
+
+Readers that may reach archived days get their entity from
+``meal_entity``/``payment_entity``: plain ``Meal``/``Payment`` when the range
+is entirely live, otherwise an alias over ``live UNION ALL archive`` that
+queries exactly like the model.
+"""
+from datetime import date
+
+from models import db, User, Meal, Payment, Checkpoint, BalanceCheckpoint, MealArchive, PaymentArchive
+import tariffs
+
+
+def closed_through():
+    """Closing date of the latest checkpoint, or None."""
+    return db.session.query(db.func.max(Checkpoint.closing_date)).scalar()
+
+
+def archived_through():
+    """Latest date whose rows have been moved to the archive tables, or None."""
+    return db.session.query(db.func.max(Checkpoint.closing_date))\
+                     .filter(Checkpoint.archived.is_(True)).scalar()
+
+
+def _entity(model, archive_model, start_date):
+    cutoff = archived_through()
+    if cutoff is None or (start_date is not None and start_date > cutoff):
+        return model
+    columns = [column.name for column in model.__table__.columns]
+    union = db.union_all(db.select(*(model.__table__.c[name] for name in columns)),
+                         db.select(*(archive_model.__table__.c[name] for name in columns)))
+    return db.aliased(model, union.subquery(f'{model.__tablename__}_all'))
+
+
+def meal_entity(start_date=None):
+    """Meal, or Meal plus MealArchive when a range starting at ``start_date`` reaches archived days."""
+    return _entity(Meal, MealArchive, start_date)
+
+
+def payment_entity(start_date=None):
+    """Payment, or Payment plus PaymentArchive when a range starting at ``start_date`` reaches archived days."""
+    return _entity(Payment, PaymentArchive, start_date)
+
+
+def checkpoint_totals(closing_date):
+    """{student_id: (meals_consumed, total_due, total_paid)} stored for a checkpoint."""
+    if closing_date is None:
+        return {}
+    return {row.student_id: (row.meals_consumed, row.total_due, row.total_paid)
+            for row in BalanceCheckpoint.query.filter_by(closing_date=closing_date)}
+
+
+def create_checkpoint(closing_date):
+    """Close every student's balance as of ``closing_date``; returns the number of students."""
+    previous = closed_through()
+    if previous is not None and closing_date <= previous:
+        raise ValueError(f'Closing date must be after the latest checkpoint ({previous})')
+    if closing_date >= date.today():
+        raise ValueError('Closing date must be in the past')
+
+    base = checkpoint_totals(previous)
+
+    # Everything after the previous checkpoint is still in the live tables
+    meal_filter = [Meal.date <= closing_date]
+    payment_filter = [Payment.date <= closing_date]
+    if previous is not None:
+        meal_filter.append(Meal.date > previous)
+        payment_filter.append(Payment.date > previous)
+
+    meal_count = db.func.sum(db.cast(Meal.breakfast, db.Integer) +
+                             db.cast(Meal.lunch, db.Integer) +
+                             db.cast(Meal.dinner, db.Integer))
+    new_meals = {student_id: (count, due) for student_id, count, due in
+                 db.session.query(Meal.student_id, meal_count, db.func.sum(tariffs.meal_price(Meal)))
+                           .filter(*meal_filter).group_by(Meal.student_id)}
+    new_paid = dict(db.session.query(Payment.student_id, db.func.sum(Payment.amount))
+                              .filter(*payment_filter).group_by(Payment.student_id))
+
+    rows = []
+    for (student_id,) in db.session.query(User.id).filter_by(role='student'):
+        meals, due, paid = base.get(student_id, (0, 0, 0))
+        added, added_due = new_meals.get(student_id, (0, 0))
+        rows.append(dict(closing_date=closing_date, student_id=student_id,
+                         meals_consumed=meals + (added or 0),
+                         total_due=due + (added_due or 0),
+                         total_paid=paid + (new_paid.get(student_id) or 0)))
+
+    db.session.add(Checkpoint(closing_date=closing_date, archived=False))
+    db.session.flush()
+    if rows:
+        db.session.execute(db.insert(BalanceCheckpoint), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def archive_closed_rows():
+    """Move Meal and Payment rows covered by the latest checkpoint into the archive tables.
+
+    Returns (meals moved, payments moved). Rows keep their ids, and the copy
+    and delete happen in one transaction.
+    """
+    closing_date = closed_through()
+    if closing_date is None:
+        raise ValueError('Create a checkpoint before archiving')
+
+    moved = []
+    for model, archive_model in ((Meal, MealArchive), (Payment, PaymentArchive)):
+        columns = [column.name for column in model.__table__.columns]
+        old_rows = db.select(*(model.__table__.c[name] for name in columns))\
+                     .where(model.__table__.c.date <= closing_date)
+        db.session.execute(db.insert(archive_model.__table__).from_select(columns, old_rows))
+        result = db.session.execute(db.delete(model.__table__).where(model.__table__.c.date <= closing_date))
+        moved.append(result.rowcount)
+
+    Checkpoint.query.filter(Checkpoint.closing_date <= closing_date)\
+                    .update({Checkpoint.archived: True}, synchronize_session=False)
+    db.session.commit()
+    return tuple(moved)
@@ -0,0 +1,122 @@
+"""Fingerprinted, precompressed static assets.
+
+``python manage.py build-assets`` copies every file under ``static/`` to
+``static/dist/`` with a content hash in its name (``js/script.3f9c2a1b7d0e.js``),
+writes ``.gz`` and ``.br`` variants of text assets (brotli only when the
+``brotli`` package is installed) and records the names in
+``static/dist/manifest.json``.
+
+Templates link assets with ``asset_url('js/script.js')``. Once a manifest
+exists this points at the hashed copy, served from ``/assets/`` with a
+one-year ``immutable`` Cache-Control and the best precompressed variant
+the browser accepts. A changed file gets a new name, so browsers never
+need to revalidate. Without a manifest (e.g. in development)
+``asset_url`` falls back to the plain ``static`` URL.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.html')
+ONE_YEAR = 365 * 24 * 3600
+
+_manifest = {}
+
+
+def _hashed_name(path, digest):
+    root, ext = os.path.splitext(path)
+    return f'{root}.{digest[:12]}{ext}'
+
+
+def build(static_folder):
+    """Write hashed and compressed copies of every static file; returns the manifest."""
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    manifest = {}
+    for folder, subfolders, files in os.walk(static_folder):
+        # Never fingerprint our own output
+        subfolders[:] = [name for name in subfolders if os.path.join(folder, name) != dist]
+        for name in sorted(files):
+            source = os.path.join(folder, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = _hashed_name(logical, hashlib.sha256(data).hexdigest())
+            target = os.path.join(dist, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            if logical.endswith(COMPRESSIBLE):
+                # mtime=0 keeps the .gz bytes identical between builds
+                variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+                if brotli is not None:
+                    variants.append(('.br', brotli.compress(data, quality=11)))
+                for suffix, compressed in variants:
+                    if len(compressed) < len(data):
+                        with open(target + suffix, 'wb') as f:
+                            f.write(compressed)
+            manifest[logical] = hashed
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    _manifest.clear()
+    _manifest.update(manifest)
+    return manifest
+
+
+def load_manifest(static_folder):
+    _manifest.clear()
+    path = os.path.join(static_folder, DIST, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            _manifest.update(json.load(f))
+    return _manifest
+
+
+def asset_url(filename):
+    """URL of a static file: its fingerprinted copy when built, the plain static URL otherwise."""
+    hashed = _manifest.get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=hashed)
+
+
+def serve_asset(filename):
+    """Serve a fingerprinted file, precompressed if the browser accepts it, cached for a year."""
+    dist = os.path.join(current_app.static_folder, DIST)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    served, encoding = filename, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] > 0 and os.path.isfile(os.path.join(dist, filename + suffix)):
+            served, encoding = filename + suffix, candidate
+            break
+
+    response = send_from_directory(dist, served, mimetype=mimetype, max_age=ONE_YEAR)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.endswith(COMPRESSIBLE):
+        response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+    return response
+
+
+def init_app(app):
+    """Load the manifest, add the /assets/ route and the ``asset_url`` template helper."""
+    load_manifest(app.static_folder)
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
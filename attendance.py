@@ -0,0 +1,192 @@
+"""Applying attendance changes (mark / unmark a meal) to the Meal table."""
+from datetime import datetime
+
+from models import db, Meal, User
+from ledger import apply_meal_changes
+import archive
+import attendance_events
+import tariffs
+import database
+import headcounts
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+ACTIONS = ('mark', 'unmark')
+
+
+def _parse_change(change):
+    """Validate one change dict and return (student_id, date, meal_type, is_marked)."""
+    try:
+        student_id = int(change['student_id'])
+        meal_date = datetime.strptime(str(change['date']), '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('student_id and date (YYYY-MM-DD) are required')
+
+    meal_type = change.get('meal_type')
+    if meal_type not in MEAL_TYPES:
+        raise ValueError(f'Unknown meal type: {meal_type}')
+    action = change.get('action')
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown action: {action}')
+
+    return student_id, meal_date, meal_type, action == 'mark'
+
+
+def set_meal_flag(student_id, meal_date, meal_type, is_marked):
+    """Set one meal flag with a single statement and return the change in meals (-1, 0 or +1).
+
+    Marking is an ``INSERT ... ON CONFLICT DO UPDATE`` that only touches the
+    row when the flag was not already set, so the affected row count tells
+    us whether the student's meal count moved. Unmarking is a plain UPDATE
+    guarded the same way; it never needs to create a row.
+    """
+    flag = Meal.__table__.c[meal_type]
+
+    if not is_marked:
+        result = db.session.execute(
+            db.update(Meal.__table__)
+              .where(Meal.__table__.c.student_id == student_id,
+                     Meal.__table__.c.date == meal_date,
+                     flag.is_(True))
+              .values({meal_type: False}))
+        return -result.rowcount
+
+    insert = database.upsert_insert()
+    if insert is None:
+        # No native upsert: read, then insert or update
+        meal = Meal.query.filter_by(student_id=student_id, date=meal_date).first()
+        if meal and getattr(meal, meal_type):
+            return 0
+        if not meal:
+            meal = Meal(student_id=student_id, date=meal_date,
+                        breakfast=False, lunch=False, dinner=False)
+            db.session.add(meal)
+        setattr(meal, meal_type, True)
+        db.session.flush()
+        return 1
+
+    values = dict(student_id=student_id, date=meal_date,
+                  breakfast=False, lunch=False, dinner=False)
+    values[meal_type] = True
+    stmt = insert(Meal.__table__).values(**values)
+    stmt = stmt.on_conflict_do_update(index_elements=['student_id', 'date'],
+                                      set_={meal_type: True},
+                                      where=db.not_(db.func.coalesce(flag, False)))
+    return db.session.execute(stmt).rowcount
+
+
+def set_meal_flags(changes):
+    """Apply a batch of ``(student_id, date, meal_type, is_marked)`` changes; returns those that moved a count.
+
+    Repeats of the same student, day and meal collapse to the last one,
+    which is the state applying them in order would leave. Each meal type
+    then takes at most two statements, however large the batch: a
+    multi-row ``INSERT ... ON CONFLICT DO UPDATE`` for the marks and a
+    guarded ``UPDATE`` for the unmarks, both with ``RETURNING`` so only
+    the rows whose flag really flipped come back. Databases without upsert
+    or ``RETURNING`` fall back to ``set_meal_flag`` per change.
+    """
+    latest = {}
+    for change in changes:
+        latest[change[:3]] = change
+    changes = list(latest.values())
+
+    insert = database.upsert_insert()
+    dialect = db.session.get_bind().dialect
+    if insert is None or not (dialect.insert_returning and dialect.update_returning):
+        return [change for change in changes if set_meal_flag(*change)]
+
+    table = Meal.__table__
+    key = (table.c.student_id, table.c.date)
+    moved = set()
+    for meal_type in MEAL_TYPES:
+        flag = table.c[meal_type]
+        marks = [(student_id, meal_date) for student_id, meal_date, change_type, is_marked in changes
+                 if change_type == meal_type and is_marked]
+        unmarks = [(student_id, meal_date) for student_id, meal_date, change_type, is_marked in changes
+                   if change_type == meal_type and not is_marked]
+        if marks:
+            rows = [dict(student_id=student_id, date=meal_date, breakfast=False, lunch=False, dinner=False)
+                    for student_id, meal_date in marks]
+            for row in rows:
+                row[meal_type] = True
+            stmt = insert(table).values(rows)
+            stmt = stmt.on_conflict_do_update(index_elements=['student_id', 'date'],
+                                              set_={meal_type: True},
+                                              where=db.not_(db.func.coalesce(flag, False)))
+            moved.update((student_id, meal_date, meal_type)
+                         for student_id, meal_date in db.session.execute(stmt.returning(*key)))
+        if unmarks:
+            stmt = db.update(table)\
+                     .where(flag.is_(True), db.tuple_(*key).in_(unmarks))\
+                     .values({meal_type: False})
+            moved.update((student_id, meal_date, meal_type)
+                         for student_id, meal_date in db.session.execute(stmt.returning(*key)))
+    return [change for change in changes if change[:3] in moved]
+
+
+def apply_changes(changes):
+    """Apply a list of attendance changes in a single transaction.
+
+    Each change is a dict with ``student_id``, ``date``, ``meal_type`` and
+    ``action``. The meal flags are written with a few statements per batch
+    (see ``set_meal_flags``), the ledgers with one executemany UPDATE and
+    the daily headcounts once per date, and everything commits together. Returns one ``{'success': ..., 'error': ...}`` dict
+    per change, in order; invalid changes, changes for unknown students and
+    changes to days closed by a balance checkpoint are reported and skipped. Changes that moved a count are then published to
+    open attendance pages (see ``attendance_events``).
+    """
+    closed = archive.closed_through()
+    results = []
+    parsed = []
+    for change in changes:
+        try:
+            change = _parse_change(change)
+            if closed is not None and change[1] <= closed:
+                raise ValueError(f'Attendance up to {closed} is closed')
+            parsed.append(change)
+            results.append({'success': True})
+        except ValueError as e:
+            parsed.append(None)
+            results.append({'success': False, 'error': str(e)})
+
+    # One query for every referenced student; an unknown id would leave orphan meal and ledger rows
+    student_ids = {p[0] for p in parsed if p}
+    known = {student_id for (student_id,) in
+             db.session.query(User.id).filter(User.id.in_(student_ids), User.role == 'student')} if student_ids else set()
+    for index, p in enumerate(parsed):
+        if p and p[0] not in known:
+            parsed[index] = None
+            results[index] = {'success': False, 'error': 'Unknown student'}
+
+    valid = [p for p in parsed if p]
+    if not valid:
+        return results
+
+    def write():
+        ledger_deltas = {}
+        headcount_deltas = {}
+        moved = set_meal_flags(valid)
+        for student_id, meal_date, meal_type, is_marked in moved:
+            delta = 1 if is_marked else -1
+            meals, due = ledger_deltas.get(student_id, (0, 0))
+            ledger_deltas[student_id] = (meals + delta, due + delta * tariffs.rate(meal_type, meal_date))
+            headcount_deltas[meal_date, meal_type] = headcount_deltas.get((meal_date, meal_type), 0) + delta
+
+        apply_meal_changes(ledger_deltas)
+        headcounts.apply_changes(headcount_deltas)
+        db.session.commit()
+        return moved
+
+    try:
+        # Another writer holding the lock is retried rather than reported as a failure
+        moved = database.with_retry(write)
+    except Exception as e:
+        db.session.rollback()
+        for result, p in zip(results, parsed):
+            if p:
+                result.update(success=False, error=str(e))
+        return results
+
+    attendance_events.publish(moved)
+
+    return results
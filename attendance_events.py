@@ -0,0 +1,217 @@
+"""Live attendance updates pushed to open attendance pages.
+
+After ``attendance.apply_changes`` commits, the meal flags that actually
+changed are published as one event per date. Each event carries the
+individual checkbox changes and the resulting headcount delta for every
+meal. ``/admin/attendance/stream`` sends the events for one date to the
+browser as server-sent events, so two counters marking the same meal stay
+in sync without polling. Events go through a pluggable backend:
+
+* ``memory`` (default): an in-process buffer with a condition variable;
+  only pages served by the same worker see each other's changes.
+* ``sqlite``: a small SQLite file shared by every worker on the host.
+  Publishers also wake the streams in their own worker at once; streams
+  served by other workers see the event on their next poll.
+
+Every event has an id ``<epoch>.<n>``, sent as the SSE ``id``: ``n``
+increases and ``epoch`` names the sequence it belongs to (one per process
+for ``memory``, one per file for ``sqlite``). A browser that reconnects
+sends the id back in ``Last-Event-ID`` and is replayed what it missed; if
+those events are no longer kept, it is told to reload. An id from another
+epoch (the reconnect reached another worker, or one that restarted) cannot
+be replayed, so the stream just starts from the current event.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app
+
+
+class MemoryBackend:
+    def __init__(self, keep):
+        self._keep = keep
+        self._start()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=self._keep)
+        self._last_id = 0
+        self._changed = threading.Condition()
+
+    def _check_fork(self):
+        # A worker forked from a preloaded master must not reuse the master's sequence
+        if os.getpid() != self._pid:
+            self._start()
+
+    @property
+    def epoch(self):
+        self._check_fork()
+        return self._epoch
+
+    def publish(self, day, payload):
+        self._check_fork()
+        with self._changed:
+            self._last_id += 1
+            self._events.append((self._last_id, day, payload))
+            self._changed.notify_all()
+
+    def last_id(self):
+        self._check_fork()
+        with self._changed:
+            return self._last_id
+
+    def read(self, after, day, timeout):
+        """Events for ``day`` newer than ``after``: ``(events, cursor)``, or ``(None, cursor)`` after a gap."""
+        self._check_fork()
+        with self._changed:
+            if self._last_id <= after:
+                self._changed.wait(timeout)
+            if after > self._last_id or (self._events and self._events[0][0] > after + 1):
+                return None, self._last_id
+            events = [(event_id, payload) for event_id, event_day, payload in self._events
+                      if event_id > after and event_day == day]
+            return events, max(after, self._last_id)
+
+
+class SQLiteBackend:
+    def __init__(self, path, keep, poll_interval):
+        self.path = path
+        self.keep = keep
+        self.poll_interval = poll_interval
+        self._changed = threading.Condition()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS attendance_events '
+                         '(id INTEGER PRIMARY KEY AUTOINCREMENT, day TEXT NOT NULL, payload TEXT NOT NULL)')
+            # Ids only mean something within one file; a recreated file gets a new epoch
+            conn.execute('CREATE TABLE IF NOT EXISTS attendance_events_epoch '
+                         '(id INTEGER PRIMARY KEY CHECK (id = 1), epoch TEXT NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO attendance_events_epoch (id, epoch) VALUES (1, ?)',
+                         (uuid.uuid4().hex[:8],))
+            self.epoch = conn.execute('SELECT epoch FROM attendance_events_epoch').fetchone()[0]
+
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across threads and forks
+        return sqlite3.connect(self.path, timeout=5)
+
+    def publish(self, day, payload):
+        with self._connect() as conn:
+            event_id = conn.execute('INSERT INTO attendance_events (day, payload) VALUES (?, ?)',
+                                    (day, payload)).lastrowid
+            if event_id % 100 == 0:
+                conn.execute('DELETE FROM attendance_events WHERE id <= ?', (event_id - self.keep,))
+        with self._changed:
+            self._changed.notify_all()
+
+    def last_id(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(id), 0) FROM attendance_events').fetchone()[0]
+
+    def read(self, after, day, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                oldest, last = conn.execute('SELECT MIN(id), COALESCE(MAX(id), 0) FROM attendance_events').fetchone()
+                if after > last or (oldest is not None and oldest > after + 1):
+                    return None, last
+                if last > after:
+                    rows = conn.execute('SELECT id, payload FROM attendance_events '
+                                        'WHERE id > ? AND day = ? ORDER BY id', (after, day)).fetchall()
+                    return rows, last
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], after
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+
+_backend = None
+
+
+def init_app(app):
+    """Create the backend selected by ATTENDANCE_EVENTS_BACKEND."""
+    global _backend
+    kind = app.config['ATTENDANCE_EVENTS_BACKEND']
+    keep = app.config['ATTENDANCE_EVENTS_KEEP']
+    if kind == 'memory':
+        _backend = MemoryBackend(keep)
+    elif kind == 'sqlite':
+        _backend = SQLiteBackend(app.config['ATTENDANCE_EVENTS_PATH'], keep,
+                                 app.config['ATTENDANCE_EVENTS_POLL_INTERVAL'])
+    else:
+        raise ValueError(f'Unknown ATTENDANCE_EVENTS_BACKEND: {kind}')
+
+
+def publish(changes):
+    """Publish committed changes: ``(student_id, date, meal_type, is_marked)`` tuples that moved a count."""
+    by_day = {}
+    for student_id, meal_date, meal_type, is_marked in changes:
+        event = by_day.setdefault(meal_date.isoformat(), {'changes': [], 'headcount': {}})
+        event['changes'].append({'student_id': student_id, 'meal_type': meal_type, 'marked': is_marked})
+        event['headcount'][meal_type] = event['headcount'].get(meal_type, 0) + (1 if is_marked else -1)
+    for day, event in by_day.items():
+        event['date'] = day
+        try:
+            _backend.publish(day, json.dumps(event))
+        except sqlite3.Error:
+            # The change is committed; open pages just miss the live update
+            current_app.logger.exception('Could not publish attendance event')
+
+
+def last_id():
+    """Id of the latest event, ``<epoch>.<n>``."""
+    return f'{_backend.epoch}.{_backend.last_id()}'
+
+
+def cursor(event_id):
+    """Position to stream from for an id sent back by the browser (None: the latest event).
+
+    Ids from another epoch start from the latest event too. Raises
+    ValueError for an id that is not ``<epoch>.<n>`` or a number.
+    """
+    if not event_id:
+        return _backend.last_id()
+    epoch, separator, number = event_id.partition('.')
+    # A bare number is an id from before ids carried an epoch
+    number = int(number if separator else epoch)
+    if not separator or epoch != _backend.epoch:
+        return _backend.last_id()
+    return number
+
+
+def _message(epoch, event_id, kind, data):
+    return f'id: {epoch}.{event_id}\nevent: {kind}\ndata: {data}\n\n'
+
+
+def stream(day, after):
+    """Yield SSE messages for ``day`` after position ``after`` (see ``cursor``), until the stream's time is up.
+
+    Reads the config up front because the generator runs after the view has
+    returned. The browser's EventSource reconnects by itself when the stream ends.
+    """
+    backend = _backend
+    heartbeat = current_app.config['ATTENDANCE_EVENTS_HEARTBEAT']
+    ends_at = time.monotonic() + current_app.config['ATTENDANCE_EVENTS_MAX_STREAM']
+
+    def generate():
+        position = after
+        # Tell the browser how soon to reconnect once this stream ends
+        yield 'retry: 1000\n\n'
+        while time.monotonic() < ends_at:
+            events, position = backend.read(position, day, min(heartbeat, max(0, ends_at - time.monotonic())))
+            if events is None:
+                yield _message(backend.epoch, position, 'reset', '{}')
+                return
+            for event_id, payload in events:
+                yield _message(backend.epoch, event_id, 'attendance', payload)
+            if not events:
+                # An id-only message moves the browser's Last-Event-ID without firing an
+                # event, and keeps proxies from closing an idle connection
+                yield f'id: {backend.epoch}.{position}\n\n'
+    return generate()
@@ -0,0 +1,137 @@
+"""Dense students x days x meals attendance cube for long-range analytics.
+
+Building ORM ``Meal`` objects for a semester of attendance is slow and
+memory hungry. For long ranges the reports instead load only the five
+columns they need in one query and pack them into a ``uint8`` NumPy array
+indexed by (student, day offset, meal), so totals are a single vectorised
+reduction. Built matrices are cached per date window together with the meal
+and user data versions (see ``data_versions``) they were built at, and are
+rebuilt once either has moved, whichever worker committed the change.
+Commits in this worker also drop them straight away.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from flask import current_app
+
+from models import db, User
+import archive
+import data_events
+import data_versions
+
+MEALS = ('breakfast', 'lunch', 'dinner')
+WATCHED_TABLES = ('meal', 'user')
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class AttendanceMatrix:
+    def __init__(self, start_date, end_date, student_ids, cube):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.student_ids = student_ids  # sorted int64 array, one per cube row
+        self.cube = cube                # uint8 array of shape (students, days, 3)
+
+    @property
+    def days(self):
+        return [self.start_date + timedelta(days=offset) for offset in range(self.cube.shape[1])]
+
+    def student_meal_totals(self):
+        """Meals eaten per student, shape (students, 3)."""
+        return self.cube.sum(axis=1, dtype=np.int64)
+
+    def meal_totals_for(self, student_ids):
+        """Meals eaten by some students, as {student_id: (breakfast, lunch, dinner)}.
+
+        Students outside the matrix (e.g. added since it was built) get zeros.
+        """
+        wanted = np.asarray(student_ids, dtype=np.int64)
+        rows = np.searchsorted(self.student_ids, wanted)
+        found = rows < len(self.student_ids)
+        found[found] = self.student_ids[rows[found]] == wanted[found]
+        totals = np.zeros((len(wanted), len(MEALS)), dtype=np.int64)
+        totals[found] = self.cube[rows[found]].sum(axis=1, dtype=np.int64)
+        return {student_id: tuple(int(count) for count in row)
+                for student_id, row in zip(wanted.tolist(), totals)}
+
+    def student_totals(self):
+        """Total meals eaten per student, shape (students,)."""
+        return self.cube.sum(axis=(1, 2), dtype=np.int64)
+
+    def daily_headcounts(self):
+        """Headcount per day and meal, shape (days, 3)."""
+        return self.cube.sum(axis=0, dtype=np.int64)
+
+    def meal_rates(self):
+        """Share of student-days on which each meal was taken, as {meal: fraction}."""
+        student_days = self.cube.shape[0] * self.cube.shape[1]
+        if not student_days:
+            return dict.fromkeys(MEALS, 0.0)
+        totals = self.cube.sum(axis=(0, 1), dtype=np.int64)
+        return {meal: float(total) / student_days for meal, total in zip(MEALS, totals)}
+
+
+def build_matrix(start_date, end_date):
+    """Load attendance between two dates (inclusive) into an AttendanceMatrix."""
+    student_ids = np.array([student_id for (student_id,) in
+                            db.session.query(User.id).filter_by(role='student').order_by(User.id)],
+                           dtype=np.int64)
+    days = (end_date - start_date).days + 1
+    cube = np.zeros((len(student_ids), max(days, 0), len(MEALS)), dtype=np.uint8)
+
+    meals = archive.meal_entity(start_date)
+    rows = db.session.execute(
+        db.select(meals.student_id, meals.date, meals.breakfast, meals.lunch, meals.dinner)
+          .where(meals.date.between(start_date, end_date))
+    ).all()
+    if rows and len(student_ids):
+        ids, dates, breakfast, lunch, dinner = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        offsets = (np.array(dates, dtype='datetime64[D]') - np.datetime64(start_date, 'D')).astype(np.int64)
+
+        # Map student ids to cube rows, dropping meals of users who are not students
+        positions = np.searchsorted(student_ids, ids).clip(max=len(student_ids) - 1)
+        known = student_ids[positions] == ids
+        positions, offsets = positions[known], offsets[known]
+
+        for meal_index, flags in enumerate((breakfast, lunch, dinner)):
+            cube[positions, offsets, meal_index] = np.array(flags, dtype=bool)[known]
+
+    return AttendanceMatrix(start_date, end_date, student_ids, cube)
+
+
+def get_matrix(start_date, end_date):
+    """Return the cached matrix for a date window, building it if missing, out of date or expired."""
+    key = (start_date, end_date)
+    ttl = current_app.config['ATTENDANCE_MATRIX_TTL']
+    now = time.monotonic()
+    # Read before building, so a commit that lands during the build leaves the entry out of date
+    versions = data_versions.current(WATCHED_TABLES)
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[1] == versions and now - entry[0] < ttl:
+            _cache.move_to_end(key)
+            return entry[2]
+
+    matrix = build_matrix(start_date, end_date)
+
+    with _cache_lock:
+        _cache[key] = (now, versions, matrix)
+        _cache.move_to_end(key)
+        while len(_cache) > current_app.config['ATTENDANCE_MATRIX_CACHE_SIZE']:
+            _cache.popitem(last=False)
+    return matrix
+
+
+def invalidate(changed_tables=None):
+    """Drop every cached matrix; runs after commits that change attendance or users."""
+    with _cache_lock:
+        _cache.clear()
+
+
+data_events.on_commit(invalidate, WATCHED_TABLES)
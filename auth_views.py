@@ -0,0 +1,84 @@
+"""Login, registration and the landing redirect."""
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+
+from models import db, User
+from ledger import ensure_ledger
+from user_cache import user_cache
+
+bp = Blueprint('auth', __name__)
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    # Served from the in-process cache; views that edit a user must invalidate it
+    return user_cache.get(int(user_id))
+
+@bp.route('/')
+def index():
+    if current_user.is_authenticated:
+        if current_user.role == 'admin':
+            return redirect(url_for('admin.dashboard'))
+        else:
+            return redirect(url_for('student.dashboard'))
+    return redirect(url_for('auth.login'))
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        user = User.query.filter_by(username=username).first()
+
+        if user and user.check_password(password):
+            login_user(user)
+            if user.role == 'admin':
+                return redirect(url_for('admin.dashboard'))
+            else:
+                return redirect(url_for('student.dashboard'))
+        else:
+            flash('Invalid username or password')
+
+    return render_template('auth/login.html')
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        name = request.form['name']
+        roll_no = request.form['roll_no']
+        room_no = request.form['room_no']
+        contact = request.form['contact']
+
+        if User.query.filter_by(username=username).first():
+            flash('Username already exists')
+            return redirect(url_for('auth.register'))
+
+        user = User(
+            username=username,
+            name=name,
+            roll_no=roll_no,
+            room_no=room_no,
+            contact=contact,
+            role='student'
+        )
+        user.set_password(password)
+        db.session.add(user)
+        db.session.flush()
+        ensure_ledger(user.id)
+        db.session.commit()
+
+        flash('Registration successful. Please login.')
+        return redirect(url_for('auth.login'))
+
+    return render_template('auth/register.html')
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('auth.login'))
@@ -0,0 +1,300 @@
+"""Route-level benchmark suite.
+
+Seeds a fresh SQLite database with ``seed.generate`` and drives every route
+through the Flask test client, logged in as the admin or a student, or
+logged out for the landing, login, registration and logout routes. For
+each route it records latency percentiles over the timed iterations, the
+number of SQL statements per request, and the peak Python memory allocated
+while serving one extra request under ``tracemalloc`` (kept out of the
+timed loop because tracing slows everything down). It also times importing
+and building the app in a fresh interpreter, with the views and without
+them as the maintenance commands do (``startup_ms``). The summary is written
+as JSON so runs on two commits can be compared:
+
+    python benchmark.py --students 500 --days 120 --output before.json
+    python benchmark.py --students 500 --days 120 --output after.json
+    python benchmark.py --compare before.json after.json
+"""
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def routes(student_ids, days, sign_in):
+    """(name, who, method, path, request kwargs for iteration i) for every benchmarked route.
+
+    ``sign_in(username, password)`` logs in on a fresh session and returns its
+    Cookie header, for routes such as logout that end the session they use.
+    """
+    import seed
+
+    today = date.today()
+    week = (today - timedelta(days=7)).isoformat(), today.isoformat()
+    full = (today - timedelta(days=days)).isoformat(), today.isoformat()
+
+    def get(**query):
+        return lambda i: {'query_string': query}
+
+    def toggle(meal_type):
+        return lambda i: {'data': {'student_id': student_ids[0], 'meal_type': meal_type,
+                                   'action': 'mark' if i % 2 == 0 else 'unmark', 'date': today.isoformat()}}
+
+    def bulk(i):
+        action = 'mark' if i % 2 == 0 else 'unmark'
+        return {'json': {'changes': [
+            {'student_id': sid, 'date': today.isoformat(), 'meal_type': 'dinner', 'action': action}
+            for sid in student_ids[:50]
+        ]}}
+
+    table = [
+        ('index', 'anonymous', 'GET', '/', get()),
+        ('admin_dashboard', 'admin', 'GET', '/admin/dashboard', get()),
+        ('admin_students', 'admin', 'GET', '/admin/students', get()),
+        ('admin_students_search', 'admin', 'GET', '/admin/students', get(q='Khan', sort='name')),
+        ('admin_attendance', 'admin', 'GET', '/admin/attendance', get()),
+        ('admin_attendance_toggle', 'admin', 'POST', '/admin/attendance', toggle('lunch')),
+        ('admin_attendance_bulk', 'admin', 'POST', '/admin/attendance/bulk', bulk),
+        ('admin_payments', 'admin', 'GET', '/admin/payments', get()),
+        ('admin_payments_record', 'admin', 'POST', '/admin/payments',
+         lambda i: {'data': {'roll_no': 'R00001', 'amount': '150'}}),
+        ('admin_cache_stats', 'admin', 'GET', '/admin/cache/stats', get()),
+        ('admin_headcount_forecast', 'admin', 'GET', '/admin/headcounts/forecast', get(history=365, days=14)),
+    ]
+    for report_type in ('attendance', 'defaulters', 'collections', 'payments'):
+        table.append((f'admin_reports_{report_type}_week', 'admin', 'GET', '/admin/reports',
+                      get(type=report_type, start_date=week[0], end_date=week[1])))
+        table.append((f'admin_reports_{report_type}_full', 'admin', 'GET', '/admin/reports',
+                      get(type=report_type, start_date=full[0], end_date=full[1])))
+        table.append((f'export_reports_{report_type}', 'admin', 'GET', '/admin/reports/export',
+                      get(type=report_type, start_date=full[0], end_date=full[1])))
+    def register(i):
+        return {'data': {'username': f'bench{i:05d}', 'password': 'bench', 'name': f'Bench {i}',
+                         'roll_no': f'B{i:05d}', 'room_no': '1', 'contact': '0300-0000000'}}
+
+    def signed_in(i):
+        return {'headers': {'Cookie': sign_in('student00001', seed.STUDENT_PASSWORD)}}
+
+    table += [
+        ('student_dashboard', 'student', 'GET', '/student/dashboard', get()),
+        ('student_attendance', 'student', 'GET', '/student/attendance',
+         get(start_date=full[0], end_date=full[1])),
+        ('student_payments', 'student', 'GET', '/student/payments', get()),
+        ('student_profile', 'student', 'GET', '/student/profile', get()),
+        # Last, as registering adds students that the routes above would otherwise see
+        ('login', 'anonymous', 'GET', '/login', get()),
+        ('login_submit', 'anonymous', 'POST', '/login',
+         lambda i: {'data': {'username': 'student00001', 'password': seed.STUDENT_PASSWORD}}),
+        ('register', 'anonymous', 'GET', '/register', get()),
+        ('register_submit', 'anonymous', 'POST', '/register', register),
+        ('logout', 'anonymous', 'GET', '/logout', signed_in),
+    ]
+    return table
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+from app import create_app
+create_app(web={web})
+print(time.perf_counter() - started)
+"""
+
+
+def startup_times(repeat=3):
+    """Best-of-``repeat`` ms to import and build the app in a fresh interpreter, with and without the views."""
+    times = {}
+    for mode, web in (('web', True), ('cli', False)):
+        runs = []
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(web=web)], capture_output=True,
+                                    text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+            runs.append(float(result.stdout.split()[-1]) * 1000)
+        times[mode] = round(min(runs), 1)
+    return times
+
+
+def run(args):
+    database = args.database or os.path.join(tempfile.mkdtemp(prefix='mess-bench-'), 'bench.db')
+    # The app reads DATABASE_URL when it is imported, so set it first
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'
+    from sqlalchemy import event
+    from app import create_app
+    from models import db, User
+    import seed
+
+    startup_ms = startup_times()
+    app = create_app()
+
+    with app.app_context():
+        started = time.perf_counter()
+        counts = seed.generate(students=args.students, days=args.days,
+                               payment_every=args.payment_every, seed=args.seed)
+        seed_seconds = time.perf_counter() - started
+        student_ids = [student_id for (student_id,) in
+                       db.session.query(User.id).filter_by(role='student').order_by(User.id)]
+
+        statements = [0]
+
+        def count_statement(*_):
+            statements[0] += 1
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    # The anonymous client keeps no cookies, so logging in through it leaves it logged out
+    clients = {'anonymous': app.test_client(use_cookies=False), 'admin': app.test_client(),
+               'student': app.test_client()}
+    clients['admin'].post('/login', data={'username': 'admin', 'password': 'admin'})
+    clients['student'].post('/login', data={'username': 'student00001', 'password': seed.STUDENT_PASSWORD})
+
+    def sign_in(username, password):
+        response = clients['anonymous'].post('/login', data={'username': username, 'password': password})
+        return '; '.join(cookie.split(';', 1)[0] for cookie in response.headers.getlist('Set-Cookie'))
+
+    def request(who, method, path, kwargs):
+        response = clients[who].open(path, method=method, **kwargs)
+        # Reading the body drains streamed responses such as the CSV exports
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    results = {}
+    for name, who, method, path, make_kwargs in routes(student_ids, args.days, sign_in):
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        for i in range(args.warmup):
+            request(who, method, path, make_kwargs(i))
+
+        timings, sql_counts, statuses = [], [], set()
+        for i in range(args.warmup, args.warmup + args.iterations):
+            # Built before timing: some kwargs (a fresh login for logout) make requests of their own
+            kwargs = make_kwargs(i)
+            statements[0] = 0
+            started = time.perf_counter()
+            statuses.add(request(who, method, path, kwargs))
+            timings.append((time.perf_counter() - started) * 1000)
+            sql_counts.append(statements[0])
+
+        kwargs = make_kwargs(args.warmup + args.iterations)
+        tracemalloc.start()
+        request(who, method, path, kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results[name] = {
+            'method': method,
+            'path': path,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'sql_statements': percentile(sql_counts, 50),
+            'sql_statements_max': max(sql_counts),
+            'peak_memory_kib': round(peak / 1024, 1),
+        }
+        if not args.quiet:
+            print(f"{name:36} p50 {results[name]['p50_ms']:9.2f} ms  p99 {results[name]['p99_ms']:9.2f} ms  "
+                  f"sql {results[name]['sql_statements']:4}  peak {results[name]['peak_memory_kib']:9.1f} KiB",
+                  file=sys.stderr)
+
+    summary = {
+        'meta': {
+            'commit': _git_commit(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'flask': importlib.metadata.version('flask'),
+            'sqlalchemy': importlib.metadata.version('sqlalchemy'),
+            'dataset': dict(students=args.students, days=args.days, payment_every=args.payment_every,
+                            seed=args.seed),
+            'rows': counts,
+            'seed_seconds': round(seed_seconds, 3),
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'startup_ms': startup_ms,
+        },
+        'routes': results,
+    }
+    output = json.dumps(summary, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+def compare(before_path, after_path):
+    """Print the change in latency, SQL statements and memory for each route in two summaries."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    if before['meta']['dataset'] != after['meta']['dataset']:
+        print('Warning: the two runs used different datasets.', file=sys.stderr)
+    for mode in ('web', 'cli'):
+        old, new = before['meta'].get('startup_ms', {}).get(mode), after['meta'].get('startup_ms', {}).get(mode)
+        if old and new:
+            print(f"startup ({mode}): {old} -> {new} ms ({new / old:.2f}x)")
+
+    print(f"{'route':36} {'p50 ms':>21} {'p99 ms':>21} {'sql':>11} {'peak KiB':>21}")
+    for name in sorted(set(before['routes']) | set(after['routes'])):
+        old, new = before['routes'].get(name), after['routes'].get(name)
+        if not old or not new:
+            print(f"{name:36} only in {'after' if new else 'before'}")
+            continue
+
+        def change(key, width=21):
+            a, b = old[key], new[key]
+            ratio = f" ({b / a:.2f}x)" if a else ''
+            return f"{f'{a} -> {b}{ratio}':>{width}}"
+        sql = f"{old['sql_statements']} -> {new['sql_statements']}"
+        print(f"{name:36} {change('p50_ms')} {change('p99_ms')} {sql:>11} {change('peak_memory_kib')}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every route against a generated database')
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--payment-every', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=20, help='Timed requests per route (default: 20)')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route first (default: 2)')
+    parser.add_argument('--only', nargs='*', help='Only routes whose name contains one of these')
+    parser.add_argument('--database', help='SQLite file to create (default: a temporary file)')
+    parser.add_argument('--output', help='Write the JSON summary here instead of stdout')
+    parser.add_argument('--quiet', action='store_true', help='Do not print per-route progress')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two JSON summaries instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
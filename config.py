@@ -1,7 +1,86 @@
 import os
 
 class Config:
-    MEAL_COST=150
+    MEAL_COST=150  # rate per meal before the first tariff for that meal (see tariffs.py)
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///mess_management.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # CSV export: rows fetched per database round trip, and bytes buffered before each flush
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_CHUNK_SIZE = 64 * 1024
+
+    # Largest number of attendance changes accepted by one bulk request
+    ATTENDANCE_BULK_LIMIT = 2000
+
+    # Attendance reports longer than this many days are summarised from the in-memory matrix
+    ATTENDANCE_MATRIX_THRESHOLD_DAYS = 31
+    ATTENDANCE_MATRIX_CACHE_SIZE = 8    # date windows kept per worker
+    ATTENDANCE_MATRIX_TTL = 300         # seconds; also rebuilt whenever meals or users change
+
+    # Rows per page on the admin tables; ?per_page= can ask for more, up to the maximum
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    # Flask-Login user cache: entries per worker and seconds before a cached user is reloaded
+    USER_CACHE_SIZE = 4096
+    USER_CACHE_TTL = 60
+
+    # Admin dashboard statistics cache: 'memory' (per worker) or 'sqlite' (shared by all workers on the host)
+    DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND', 'memory')
+    DASHBOARD_CACHE_PATH = os.environ.get('DASHBOARD_CACHE_PATH', 'dashboard_cache.sqlite')
+    DASHBOARD_CACHE_TTL = 300           # seconds, bounds staleness from writes made outside the app
+
+    # Bulk student CSV import: rows per insert transaction, password hashing processes, file size cap
+    IMPORT_BATCH_SIZE = 500
+    IMPORT_HASH_WORKERS = os.cpu_count() or 1
+    IMPORT_MAX_ROWS = 5000
+
+    # Request metrics: Server-Timing headers, N+1 warnings and the /admin/metrics page
+    METRICS_ENABLED = True
+    METRICS_N_PLUS_ONE_THRESHOLD = 10   # repeats of one statement in a request before warning
+    METRICS_WINDOW = 1000               # recent requests kept per endpoint
+
+    # Database profile: 'auto' (from the URL), 'sqlite', 'server' or 'none'
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'auto')
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KIB = 64 * 1024
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = 30        # seconds to wait for a free connection
+    DB_POOL_RECYCLE = 1800      # seconds before a connection is replaced
+    DB_POOL_PRE_PING = True
+
+    # Writes that hit a lock or deadlock are retried with jittered exponential backoff
+    DB_RETRY_ATTEMPTS = 5
+    DB_RETRY_BASE_DELAY = 0.05  # seconds
+    DB_RETRY_MAX_DELAY = 1.0
+
+    # Rendered reports and exports of closed date ranges kept per worker, and the largest one kept
+    REPORT_CACHE_SIZE = 32
+    REPORT_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+    # Background exports: spool directory (default: instance/exports), concurrent and queued jobs per worker,
+    # and how long finished files stay downloadable
+    EXPORT_SPOOL_DIR = os.environ.get('EXPORT_SPOOL_DIR')
+    EXPORT_JOB_WORKERS = 2
+    EXPORT_JOB_QUEUE_LIMIT = 8
+    EXPORT_JOB_RETENTION_HOURS = 24
+
+    # Live attendance updates: 'memory' (per worker) or 'sqlite' (shared by all workers on the host),
+    # events kept for reconnecting pages, and how long one event stream stays open
+    ATTENDANCE_EVENTS_BACKEND = os.environ.get('ATTENDANCE_EVENTS_BACKEND', 'memory')
+    ATTENDANCE_EVENTS_PATH = os.environ.get('ATTENDANCE_EVENTS_PATH', 'attendance_events.sqlite')
+    ATTENDANCE_EVENTS_KEEP = 1000
+    ATTENDANCE_EVENTS_POLL_INTERVAL = 0.5   # seconds between checks of the shared file
+    ATTENDANCE_EVENTS_HEARTBEAT = 15        # seconds between keep-alive messages
+    ATTENDANCE_EVENTS_MAX_STREAM = 300      # seconds; the browser reconnects straight away
+
+    # Longest a worker keeps its cached meal rates; every worker reloads them as soon as a rate changes
+    TARIFF_CACHE_SECONDS = 60
+
+    # Headcount trends and the kitchen forecast: longest history shown, longest forecast, days of trend fitted
+    HEADCOUNT_HISTORY_MAX_DAYS = 365
+    FORECAST_MAX_DAYS = 28
+    FORECAST_TREND_WINDOW = 28
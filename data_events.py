@@ -0,0 +1,91 @@
+"""Commit-time notifications about which tables a transaction changed.
+
+Caches built from the database register a callback with ``on_commit`` and
+are told, after each successful commit, the names of the tables that were
+written. ORM flushes are picked up by ``after_flush``; bulk and Core
+statements run through the session (upserts, ``Query.update``/``delete``)
+are picked up by ``do_orm_execute``. Nothing fires for rolled-back work.
+
+``before_commit`` callbacks run inside the transaction instead, so whatever
+they write commits (or rolls back) together with the changes they saw.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_callbacks = []
+_before_callbacks = []
+_registered = False
+
+
+def _add(callbacks, callback, tables):
+    # Every app created in the process registers the same callbacks; keep one copy
+    if all(registered is not callback for registered, _ in callbacks):
+        callbacks.append((callback, frozenset(tables) if tables else None))
+
+
+def on_commit(callback, tables=None):
+    """Call ``callback(changed_tables)`` after commits that touch any of ``tables`` (or any table)."""
+    _add(_callbacks, callback, tables)
+
+
+def before_commit(callback, tables=None):
+    """Call ``callback(session, changed_tables)`` just before commits that touch any of ``tables``."""
+    _add(_before_callbacks, callback, tables)
+
+
+def _pending(session):
+    return session.info.setdefault('changed_tables', set())
+
+
+def _after_flush(session, flush_context):
+    pending = _pending(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table:
+            pending.add(table)
+
+
+def _do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _pending(orm_execute_state.session).add(table.name)
+
+
+def _before_commit(session):
+    if not _before_callbacks:
+        return
+    # Flush first so changes still pending in the session are counted
+    session.flush()
+    changed = set(session.info.get('changed_tables', ()))
+    if not changed:
+        return
+    for callback, tables in _before_callbacks:
+        if tables is None or tables & changed:
+            callback(session, changed)
+
+
+def _after_commit(session):
+    changed = session.info.pop('changed_tables', None)
+    if not changed:
+        return
+    for callback, tables in _callbacks:
+        if tables is None or tables & changed:
+            callback(changed)
+
+
+def _after_rollback(session):
+    session.info.pop('changed_tables', None)
+
+
+def register():
+    """Install the session listeners once per process."""
+    global _registered
+    if _registered:
+        return
+    event.listen(Session, 'after_flush', _after_flush)
+    event.listen(Session, 'do_orm_execute', _do_orm_execute)
+    event.listen(Session, 'before_commit', _before_commit)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_rollback', _after_rollback)
+    _registered = True
@@ -0,0 +1,44 @@
+"""Version counters for the tables that reports are built from.
+
+Every commit that writes meals, payments, users, ledgers, daily
+headcounts or tariffs also increments the counter of each table it touched, plus the
+global ``*`` counter, in the same transaction. Comparing counters is then a cheap way for any worker to
+tell whether data behind a cached or previously sent response may have
+changed, without looking at the data itself.
+"""
+from models import db, DataVersion
+import data_events
+import database
+
+VERSIONED_TABLES = ('meal', 'payment', 'user', 'student_ledger', 'daily_headcount', 'tariff')
+GLOBAL = '*'
+
+
+def _bump(session, changed_tables):
+    names = sorted(set(changed_tables) & set(VERSIONED_TABLES)) + [GLOBAL]
+    insert = database.upsert_insert()
+    for name in names:
+        if insert is not None:
+            stmt = insert(DataVersion.__table__).values(table_name=name, version=1)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=['table_name'],
+                set_={'version': DataVersion.__table__.c.version + 1}))
+        else:
+            updated = session.execute(db.update(DataVersion.__table__)
+                                        .where(DataVersion.__table__.c.table_name == name)
+                                        .values(version=DataVersion.__table__.c.version + 1)).rowcount
+            if not updated:
+                session.execute(db.insert(DataVersion.__table__).values(table_name=name, version=1))
+
+
+def current(tables=(GLOBAL,)):
+    """{table: version} for ``tables`` (table names or GLOBAL), in one query."""
+    names = list(tables)
+    versions = dict.fromkeys(names, 0)
+    versions.update(db.session.query(DataVersion.table_name, DataVersion.version)
+                              .filter(DataVersion.table_name.in_(names)))
+    return versions
+
+
+def register():
+    data_events.before_commit(_bump, VERSIONED_TABLES)
@@ -0,0 +1,143 @@
+"""Database profiles and retrying writes that hit transient lock errors.
+
+``DATABASE_PROFILE`` picks how the engine is tuned (``auto`` chooses from
+the database URL):
+
+* ``sqlite``: every new connection switches to WAL, ``synchronous=NORMAL``,
+  a busy timeout, memory-mapped I/O and a larger page cache, so readers no
+  longer block the writer and several workers can share one file.
+* ``server`` (PostgreSQL, MySQL): a connection pool sized by the ``DB_POOL_*``
+  settings, with pre-ping and recycling so dropped connections are replaced.
+* ``none``: leave the engine as Flask-SQLAlchemy builds it.
+
+Even in WAL mode SQLite allows one writer at a time, and a server database
+may abort a transaction on deadlock or serialization failure. ``with_retry``
+runs a unit of work again, after a rollback and a jittered exponential
+backoff, when that happens.
+
+Connections must not cross a fork: ``dispose_after_fork`` gives each
+preforked worker an empty pool.
+"""
+import random
+import sqlite3
+import time
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.pool import Pool
+
+from models import db
+
+# Substrings of SQLite errors, and PostgreSQL SQLSTATEs, worth retrying
+SQLITE_LOCK_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+TRANSIENT_PGCODES = ('40001', '40P01')  # serialization_failure, deadlock_detected
+
+_sqlite_pragmas = []
+_listening = False
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in _sqlite_pragmas:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def _profile(app):
+    profile = app.config['DATABASE_PROFILE']
+    if profile == 'auto':
+        return 'sqlite' if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') else 'server'
+    if profile not in ('sqlite', 'server', 'none'):
+        raise ValueError(f'Unknown DATABASE_PROFILE: {profile}')
+    return profile
+
+
+def configure(app):
+    """Apply the selected profile; call before ``db.init_app(app)``.
+
+    Engine options already in ``SQLALCHEMY_ENGINE_OPTIONS`` take precedence.
+    """
+    global _listening
+    profile = _profile(app)
+    options = {}
+    if profile == 'sqlite':
+        options['connect_args'] = {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}
+        _sqlite_pragmas[:] = [
+            'PRAGMA journal_mode=WAL',
+            'PRAGMA synchronous=NORMAL',
+            f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}",
+            f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}",
+            # Negative sizes are in KiB rather than pages
+            f"PRAGMA cache_size=-{int(app.config['SQLITE_CACHE_SIZE_KIB'])}",
+        ]
+        if not _listening:
+            event.listen(Pool, 'connect', _set_sqlite_pragmas)
+            _listening = True
+    elif profile == 'server':
+        options.update(pool_size=app.config['DB_POOL_SIZE'],
+                       max_overflow=app.config['DB_MAX_OVERFLOW'],
+                       pool_timeout=app.config['DB_POOL_TIMEOUT'],
+                       pool_recycle=app.config['DB_POOL_RECYCLE'],
+                       pool_pre_ping=app.config['DB_POOL_PRE_PING'])
+
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    return profile
+
+
+def upsert_insert():
+    """Return the dialect's INSERT construct with ON CONFLICT support, if it has one."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def is_transient(error):
+    """True for lock, deadlock and serialization errors that may succeed if retried."""
+    if isinstance(error, OperationalError) and \
+            any(message in str(error.orig).lower() for message in SQLITE_LOCK_MESSAGES):
+        return True
+    return isinstance(error, DBAPIError) and getattr(error.orig, 'pgcode', None) in TRANSIENT_PGCODES
+
+
+def with_retry(work):
+    """Run ``work()`` (which must commit), retrying it on transient lock errors.
+
+    The session is rolled back before each retry, so ``work`` has to redo
+    everything it wrote. Other errors, and the last transient one, are raised.
+    """
+    attempts = current_app.config['DB_RETRY_ATTEMPTS']
+    delay = current_app.config['DB_RETRY_BASE_DELAY']
+    for attempt in range(1, attempts + 1):
+        try:
+            return work()
+        except DBAPIError as e:
+            db.session.rollback()
+            if attempt == attempts or not is_transient(e):
+                raise
+            current_app.logger.info('Retrying after transient database error (attempt %d): %s', attempt, e.orig)
+            if has_request_context():
+                # Reported in the Server-Timing header (see metrics)
+                g.db_retries = g.get('db_retries', 0) + 1
+            # Full jitter keeps workers that collided from retrying in lockstep
+            time.sleep(random.uniform(0, min(delay * 2 ** (attempt - 1), current_app.config['DB_RETRY_MAX_DELAY'])))
+
+
+def dispose_after_fork(app):
+    """Drop pooled connections inherited from the parent process.
+
+    Call in each worker after a preforking server (gunicorn ``--preload``)
+    forks. The engine object itself is shared; ``close=False`` leaves the
+    parent's sockets alone and the worker opens its own on first use.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,195 @@
+"""Background report exports written to a spool directory.
+
+Long exports (years of attendance) are too slow to stream inside a web
+request. ``submit`` queues the export on a small thread pool in this worker
+and returns a job id straight away; the thread writes the file into
+``EXPORT_SPOOL_DIR`` and keeps a ``<job id>.json`` status file next to it
+up to date. Because state lives in the spool directory rather than in
+memory, any worker on the host can answer status and download requests.
+
+At most ``EXPORT_JOB_WORKERS`` exports run at once per worker process (and
+``EXPORT_JOB_QUEUE_LIMIT`` wait), so exports never take over the database
+connections and CPU that interactive requests need. ``sweep`` deletes files
+older than ``EXPORT_JOB_RETENTION_HOURS``; it runs on every submission and
+from ``python manage.py sweep-exports``.
+"""
+import gzip
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+import reports
+
+# openpyxl takes a while to import, so it is only loaded by the first XLSX export
+HAVE_OPENPYXL = importlib.util.find_spec('openpyxl') is not None
+
+REPORT_TYPES = ('attendance', 'defaulters', 'collections', 'payments')
+FORMATS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'xlsx': '.xlsx'}
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ExportJobError(ValueError):
+    """The export cannot be queued (unknown format, too many jobs...)."""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def _spool_dir(app):
+    path = app.config['EXPORT_SPOOL_DIR'] or os.path.join(app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _status_path(spool, job_id):
+    return os.path.join(spool, f'{job_id}.json')
+
+
+def _write_status(spool, job_id, status):
+    # Write then rename, so readers never see a half-written file
+    path = _status_path(spool, job_id)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(status, f)
+    os.replace(path + '.tmp', path)
+
+
+def _count_rows(report_type, start_date, end_date):
+    if report_type == 'attendance':
+        query, _ = reports.attendance_rows(start_date, end_date)
+    elif report_type == 'payments':
+        query, _ = reports.payment_rows(start_date, end_date)
+    else:
+        return None
+    return query.order_by(None).count()
+
+
+def _write_file(path, file_format, rows):
+    if file_format == 'xlsx':
+        import openpyxl
+
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+        return
+
+    opener = gzip.open if file_format == 'csv.gz' else open
+    with opener(path, 'wb') as f:
+        for chunk in reports.stream_csv(rows):
+            f.write(chunk)
+
+
+def _run(app, job_id, status, start_date, end_date):
+    global _pending
+    spool = _spool_dir(app)
+    path = os.path.join(spool, status['filename'])
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    try:
+        with app.app_context():
+            status.update(state='running', started_at=time.time())
+            status['total_rows'] = _count_rows(status['report_type'], start_date, end_date)
+            _write_status(spool, job_id, status)
+
+            def with_progress(rows):
+                yield next(rows)  # header
+                for row in rows:
+                    yield row
+                    status['rows_written'] += 1
+                    if status['rows_written'] % batch_size == 0:
+                        _write_status(spool, job_id, status)
+
+            rows = reports.export_rows(status['report_type'], start_date, end_date, batch_size=batch_size)
+            _write_file(path + '.part', status['format'], with_progress(rows))
+            os.replace(path + '.part', path)
+            status.update(state='done', finished_at=time.time(), size=os.path.getsize(path))
+    except Exception as e:
+        app.logger.exception('Export job %s failed', job_id)
+        status.update(state='failed', finished_at=time.time(), error=str(e))
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+    finally:
+        _write_status(spool, job_id, status)
+        with _executor_lock:
+            _pending -= 1
+
+
+def submit(report_type, start_date, end_date, file_format='csv'):
+    """Queue an export and return its status dict (with ``id``)."""
+    global _executor, _pending
+    app = current_app._get_current_object()
+    if report_type not in REPORT_TYPES:
+        raise ExportJobError(f'Unknown report type: {report_type}')
+    if file_format not in FORMATS:
+        raise ExportJobError(f'Unknown format: {file_format}')
+    if file_format == 'xlsx' and not HAVE_OPENPYXL:
+        raise ExportJobError('XLSX export needs the openpyxl package')
+
+    sweep(app)
+    with _executor_lock:
+        if _pending >= app.config['EXPORT_JOB_WORKERS'] + app.config['EXPORT_JOB_QUEUE_LIMIT']:
+            raise ExportJobError('Too many exports are running. Try again in a minute.')
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_JOB_WORKERS'],
+                                           thread_name_prefix='export-job')
+        _pending += 1
+
+    job_id = uuid.uuid4().hex
+    status = {
+        'id': job_id,
+        'state': 'queued',
+        'report_type': report_type,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'format': file_format,
+        'filename': f'{job_id}{FORMATS[file_format]}',
+        'download_name': f'{report_type}_report_{start_date}_to_{end_date}{FORMATS[file_format]}',
+        'rows_written': 0,
+        'total_rows': None,
+        'created_at': time.time(),
+    }
+    _write_status(_spool_dir(app), job_id, status)
+    _executor.submit(_run, app, job_id, dict(status), start_date, end_date)
+    return status
+
+
+def get_status(job_id):
+    """The job's status dict, or None if the id is unknown or expired."""
+    if not JOB_ID.match(job_id or ''):
+        return None
+    try:
+        with open(_status_path(_spool_dir(current_app), job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def result_path(status):
+    """Directory and file name of a finished job's output."""
+    return _spool_dir(current_app), status['filename']
+
+
+def sweep(app=None):
+    """Delete job files older than the retention period; returns the number removed."""
+    app = app or current_app
+    spool = _spool_dir(app)
+    cutoff = time.time() - app.config['EXPORT_JOB_RETENTION_HOURS'] * 3600
+    removed = 0
+    for name in os.listdir(spool):
+        path = os.path.join(spool, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
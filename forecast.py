@@ -0,0 +1,75 @@
+"""Kitchen demand forecast from the daily headcount rollup.
+
+The forecast for a future day is the sum of two parts, computed per meal
+with NumPy over the whole history at once:
+
+* trend: a straight line fitted to the 7-day moving average over the last
+  ``trend_window`` days, extended to that day;
+* weekday effect: how far that weekday's headcount has typically sat from
+  the trend line over the last four weeks (weekend lunches are smaller, and
+  so on).
+
+Predictions are clipped at zero and rounded to whole plates.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+WEEK = 7
+
+
+def moving_average(counts, window=WEEK):
+    """Trailing ``window``-day mean for each day, shape (days, 3); NaN until a full window exists."""
+    counts = np.asarray(counts, dtype=float).reshape(-1, len(MEAL_TYPES))
+    averages = np.full(counts.shape, np.nan)
+    if len(counts) >= window:
+        cumulative = np.cumsum(np.vstack([np.zeros((1, counts.shape[1])), counts]), axis=0)
+        averages[window - 1:] = (cumulative[window:] - cumulative[:-window]) / window
+    return averages
+
+
+def weekday_effects(dates, counts, weeks=4):
+    """Mean difference between each weekday's value and the overall mean over recent weeks, shape (7, 3)."""
+    recent = np.asarray(counts, dtype=float)[-weeks * WEEK:]
+    weekdays = np.array([day.weekday() for day in dates[-len(recent):]])
+    effects = np.zeros((WEEK, len(MEAL_TYPES)))
+    if not len(recent):
+        return effects
+    overall = recent.mean(axis=0)
+    for weekday in np.unique(weekdays):
+        effects[weekday] = recent[weekdays == weekday].mean(axis=0) - overall
+    return effects
+
+
+def project(dates, counts, days, trend_window=28):
+    """Forecast ``days`` days after ``dates[-1]`` from the daily ``counts`` on ``dates``.
+
+    Returns a list of {'date', 'breakfast', 'lunch', 'dinner'} dicts.
+    """
+    counts = np.asarray(counts, dtype=float).reshape(-1, len(MEAL_TYPES))
+    future_dates = [dates[-1] + timedelta(days=h) for h in range(1, days + 1)] if dates else []
+    # Days before the first recorded meal predate the system, not an empty mess
+    used = np.flatnonzero(counts.sum(axis=1))
+    if not len(used) or not future_dates:
+        return [dict(date=day.isoformat(), **dict.fromkeys(MEAL_TYPES, 0)) for day in future_dates]
+    counts, dates = counts[used[0]:], dates[used[0]:]
+    n = len(counts)
+
+    averages = moving_average(counts)
+    # A trailing average ending on day i describes the middle of its window
+    positions = np.arange(n) - (WEEK - 1) / 2
+    valid = ~np.isnan(averages[:, 0])
+    valid[:max(0, n - trend_window)] = False
+    if valid.sum() >= 2:
+        slope, intercept = np.polyfit(positions[valid], averages[valid], 1)
+    else:
+        slope, intercept = np.zeros(len(MEAL_TYPES)), counts.mean(axis=0)
+    trend = intercept + np.outer(np.arange(n, n + days), slope)
+
+    # Weekday effects are measured against the trend line, so growth is not mistaken for one
+    fitted = intercept + np.outer(np.arange(n), slope)
+    effects = weekday_effects(dates, counts - fitted)[[day.weekday() for day in future_dates]]
+    predicted = np.rint(np.clip(trend + effects, 0, None)).astype(int)
+    return [dict(date=day.isoformat(), **dict(zip(MEAL_TYPES, map(int, row))))
+            for day, row in zip(future_dates, predicted)]
@@ -0,0 +1,43 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py``.
+
+The app is built once in the master and the workers are forked from it, so
+they share its imported code instead of each loading their own copy.
+
+Workers are threaded: an open attendance page keeps a server-sent event
+stream for up to ``ATTENDANCE_EVENTS_MAX_STREAM`` seconds, which holds one
+thread rather than a whole worker, and the timeout is set above that so
+the stream is not killed as a stuck worker.
+
+Forked workers do not share memory, so unless they are set in the
+environment the attendance events and the dashboard stats cache use their
+SQLite backends here, shared by every worker on the host.
+"""
+import multiprocessing
+import os
+
+# Must be set before the app (and its config) is loaded
+os.environ.setdefault('ATTENDANCE_EVENTS_BACKEND', 'sqlite')
+os.environ.setdefault('DASHBOARD_CACHE_BACKEND', 'sqlite')
+
+from config import Config
+
+wsgi_app = 'app:app'
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = Config.ATTENDANCE_EVENTS_MAX_STREAM + 60
+preload_app = True
+
+
+def when_ready(server):
+    # Report and export modules are otherwise imported by each worker on its first report
+    import app
+    app.preload_modules()
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with the workers
+    import app
+    import database
+    database.dispose_after_fork(app.app)
@@ -0,0 +1,131 @@
+"""Daily headcount rollup: one row per date with its breakfast, lunch and dinner counts.
+
+``attendance.apply_changes`` moves the counts in the same transaction as the
+meal flags, and deleting a student takes their meals out first, so the
+rollup always matches Meal plus MealArchive. The dashboard, trend charts
+and the kitchen forecast (see ``forecast``) read a few hundred rollup rows
+instead of scanning the meal table. ``rebuild`` recomputes the rollup from
+scratch (``python manage.py rebuild-headcounts``), e.g. after rows were
+bulk loaded.
+"""
+from datetime import timedelta
+
+from models import db, Meal, MealArchive, DailyHeadcount
+import archive
+import database
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+
+
+def apply_changes(deltas):
+    """Add ``{(date, meal_type): delta}`` to the rollup; zero deltas are skipped."""
+    by_day = {}
+    for (meal_date, meal_type), delta in deltas.items():
+        if delta:
+            by_day.setdefault(meal_date, dict.fromkeys(MEAL_TYPES, 0))[meal_type] += delta
+
+    table = DailyHeadcount.__table__
+    insert = database.upsert_insert()
+    for meal_date, counts in sorted(by_day.items()):
+        increments = {meal_type: table.c[meal_type] + delta for meal_type, delta in counts.items() if delta}
+        if insert is not None:
+            stmt = insert(table).values(date=meal_date, **counts)
+            db.session.execute(stmt.on_conflict_do_update(index_elements=['date'], set_=increments))
+            continue
+        updated = db.session.execute(db.update(table).where(table.c.date == meal_date)
+                                       .values(increments)).rowcount
+        if not updated:
+            db.session.execute(db.insert(table).values(date=meal_date, **counts))
+
+
+def _counts_query(meals):
+    return db.session.query(meals.date,
+                            *(db.func.coalesce(db.func.sum(db.cast(getattr(meals, meal_type), db.Integer)), 0)
+                              for meal_type in MEAL_TYPES))
+
+
+def remove_student(student_id):
+    """Take a student's meals (live and archived) out of the rollup before they are deleted."""
+    table = DailyHeadcount.__table__
+    for model in (Meal, MealArchive):
+        meals = model.__table__
+        # One UPDATE per table; the subqueries are correlated with the rollup row's date
+        theirs = db.and_(meals.c.student_id == student_id, meals.c.date == table.c.date)
+        db.session.execute(
+            db.update(table)
+              .where(table.c.date.in_(db.select(meals.c.date).where(meals.c.student_id == student_id)))
+              .values({meal_type: table.c[meal_type] -
+                       db.select(db.func.coalesce(db.func.sum(db.cast(meals.c[meal_type], db.Integer)), 0))
+                         .where(theirs).scalar_subquery()
+                       for meal_type in MEAL_TYPES}))
+
+
+def rebuild():
+    """Recompute the rollup from every meal, live and archived; returns the number of days."""
+    DailyHeadcount.query.delete()
+    meals = archive.meal_entity()
+    rows = [dict(zip(('date', *MEAL_TYPES), row)) for row in _counts_query(meals).group_by(meals.date)]
+    if rows:
+        db.session.execute(db.insert(DailyHeadcount), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def verify(start_date=None, end_date=None):
+    """Return (date, stored, expected) for each day whose rollup disagrees with the meal tables."""
+    meals = archive.meal_entity(start_date)
+    query = _counts_query(meals)
+    stored_query = DailyHeadcount.query
+    if start_date:
+        query = query.filter(meals.date >= start_date)
+        stored_query = stored_query.filter(DailyHeadcount.date >= start_date)
+    if end_date:
+        query = query.filter(meals.date <= end_date)
+        stored_query = stored_query.filter(DailyHeadcount.date <= end_date)
+    expected = {row[0]: tuple(row[1:]) for row in query.group_by(meals.date)}
+    stored = {row.date: (row.breakfast, row.lunch, row.dinner) for row in stored_query}
+    return [(day, stored.get(day, (0, 0, 0)), expected.get(day, (0, 0, 0)))
+            for day in sorted(set(expected) | set(stored))
+            if stored.get(day, (0, 0, 0)) != expected.get(day, (0, 0, 0))]
+
+
+def series(start_date, end_date):
+    """Headcounts for every day in the range, days without meals as zeros.
+
+    Returns (dates, counts), where counts is a list of (breakfast, lunch, dinner).
+    """
+    stored = {row.date: (row.breakfast, row.lunch, row.dinner)
+              for row in DailyHeadcount.query.filter(DailyHeadcount.date.between(start_date, end_date))}
+    dates = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    return dates, [stored.get(day, (0, 0, 0)) for day in dates]
+
+
+def for_day(day):
+    """(breakfast, lunch, dinner) headcounts for one date."""
+    row = db.session.get(DailyHeadcount, day)
+    return (row.breakfast, row.lunch, row.dinner) if row else (0, 0, 0)
+
+
+def trend(end_date, history_days, forecast_days, trend_window=28):
+    """Chart data: daily headcounts and their 7-day average up to ``end_date``, then the forecast.
+
+    Returns a JSON-ready dict with ``history`` and ``forecast`` lists of
+    {'date', 'breakfast', 'lunch', 'dinner'} and ``moving_average`` aligned
+    with ``history`` (None until a full week is available).
+    """
+    # NumPy is only loaded for charts; attendance writes import this module too
+    import numpy as np
+    import forecast
+
+    # The forecast needs a full trend window plus one week of averaging, whatever is shown
+    loaded_days = max(history_days, trend_window + forecast.WEEK - 1)
+    dates, counts = series(end_date - timedelta(days=loaded_days - 1), end_date)
+    averages = forecast.moving_average(counts)[-history_days:]
+    return {
+        'history': [dict(date=day.isoformat(), **dict(zip(MEAL_TYPES, row)))
+                    for day, row in zip(dates[-history_days:], counts[-history_days:])],
+        'moving_average': [None if np.isnan(average[0]) else
+                           dict(zip(MEAL_TYPES, (round(float(value), 1) for value in average)))
+                           for average in averages],
+        'forecast': forecast.project(dates, counts, forecast_days, trend_window),
+    }
@@ -1,4 +1,8 @@
-from app import app, db, User
+from app import create_app
+from models import db, User
+
+# Only the database is needed, not the views
+app = create_app(web=False)
 
 with app.app_context():
     print("Creating database tables and admin user...")
@@ -0,0 +1,222 @@
+"""Running totals kept in step with the Meal and Payment tables.
+
+Two summaries live here: the per-student ledger (meals, dues, payments,
+balance) and the per-month collections rollup. Every write path that
+changes them calls one of the ``apply_*`` helpers inside its own
+transaction, so the summary rows commit (or roll back) together with the
+change they describe. The ``rebuild_*`` and ``verify_ledgers`` functions
+recompute the same totals from scratch for repair and audit.
+"""
+from datetime import date, datetime, timedelta
+
+from models import db, User, Meal, Payment, StudentLedger, MonthlyCollection, BalanceCheckpoint
+import archive
+import tariffs
+
+
+def ensure_ledger(student_id):
+    """Create an empty ledger row for a student if one does not exist yet."""
+    ledger = db.session.get(StudentLedger, student_id)
+    if ledger is None:
+        ledger = StudentLedger(student_id=student_id, meals_consumed=0,
+                               total_due=0, total_paid=0, balance=0,
+                               last_updated=datetime.utcnow())
+        db.session.add(ledger)
+    return ledger
+
+
+def _increment(student_id, meals=0, due=0.0, paid=0.0):
+    # Increment in SQL so concurrent writers never overwrite each other's totals
+    updated = StudentLedger.query.filter_by(student_id=student_id).update({
+        StudentLedger.meals_consumed: StudentLedger.meals_consumed + meals,
+        StudentLedger.total_due: StudentLedger.total_due + due,
+        StudentLedger.total_paid: StudentLedger.total_paid + paid,
+        StudentLedger.balance: StudentLedger.balance + paid - due,
+        StudentLedger.last_updated: datetime.utcnow(),
+    }, synchronize_session=False)
+
+    if not updated:
+        # No row yet (e.g. student created before the ledger existed)
+        ledger = ensure_ledger(student_id)
+        ledger.meals_consumed += meals
+        ledger.total_due += due
+        ledger.total_paid += paid
+        ledger.balance = ledger.total_paid - ledger.total_due
+
+
+def apply_meal_changes(deltas):
+    """Record ``{student_id: (meals_delta, due_delta)}``: meals gained (+) or lost (-) and their price.
+
+    One executemany UPDATE covers every student; students without a ledger
+    row yet get one through ``_increment``.
+    """
+    rows = [dict(ledger_student=student_id, meals=meals, due=due)
+            for student_id, (meals, due) in deltas.items() if meals or due]
+    if not rows:
+        return
+    table = StudentLedger.__table__
+    updated = db.session.execute(
+        db.update(table)
+          .where(table.c.student_id == db.bindparam('ledger_student'))
+          .values(meals_consumed=table.c.meals_consumed + db.bindparam('meals'),
+                  total_due=table.c.total_due + db.bindparam('due'),
+                  balance=table.c.balance - db.bindparam('due'),
+                  last_updated=datetime.utcnow()),
+        rows).rowcount
+    if updated != len(rows):
+        have = {student_id for (student_id,) in db.session.query(StudentLedger.student_id)
+                .filter(StudentLedger.student_id.in_([row['ledger_student'] for row in rows]))}
+        for row in rows:
+            if row['ledger_student'] not in have:
+                _increment(row['ledger_student'], meals=row['meals'], due=row['due'])
+
+
+def apply_payment(student_id, amount):
+    """Record a payment of ``amount`` made by a student."""
+    _increment(student_id, paid=float(amount))
+
+
+def calculate_balance(user_id, start_date=None, end_date=None):
+    if not end_date:
+        end_date = date.today()
+
+    base_due = base_paid = 0
+    if not start_date:
+        # Start from the student's latest checkpoint instead of scanning all history
+        checkpoint = BalanceCheckpoint.query.filter(BalanceCheckpoint.student_id == user_id,
+                                                    BalanceCheckpoint.closing_date < end_date)\
+                                            .order_by(BalanceCheckpoint.closing_date.desc()).first()
+        if checkpoint:
+            base_due, base_paid = checkpoint.total_due, checkpoint.total_paid
+            start_date = checkpoint.closing_date + timedelta(days=1)
+        else:
+            start_date = datetime.strptime('2023-01-01', '%Y-%m-%d').date()
+
+    meals = archive.meal_entity(start_date)
+    payments = archive.payment_entity(start_date)
+
+    meals_due = db.session.query(db.func.sum(tariffs.meal_price(meals))) \
+                          .filter(meals.student_id == user_id) \
+                          .filter(meals.date.between(start_date, end_date)) \
+                          .scalar() or 0
+    
+    total_paid = db.session.query(db.func.sum(payments.amount)) \
+                           .filter(payments.student_id == user_id) \
+                           .filter(payments.date.between(start_date, end_date)) \
+                           .scalar() or 0
+
+    total_due = base_due + meals_due
+    total_paid = base_paid + total_paid
+    balance = total_paid - total_due
+
+    return total_due, total_paid, balance
+
+
+def compute_totals():
+    """Recompute {student_id: (meals_consumed, total_due, total_paid)} from the source tables.
+
+    Starts from the latest balance checkpoint and adds the live rows after it.
+    """
+    closing_date = archive.closed_through()
+    base = archive.checkpoint_totals(closing_date)
+
+    meal_count = db.func.sum(db.cast(Meal.breakfast, db.Integer) +
+                             db.cast(Meal.lunch, db.Integer) +
+                             db.cast(Meal.dinner, db.Integer))
+    meals_query = db.session.query(Meal.student_id, meal_count, db.func.sum(tariffs.meal_price(Meal)))\
+                            .group_by(Meal.student_id)
+    paid_query = db.session.query(Payment.student_id, db.func.sum(Payment.amount)).group_by(Payment.student_id)
+    if closing_date is not None:
+        meals_query = meals_query.filter(Meal.date > closing_date)
+        paid_query = paid_query.filter(Payment.date > closing_date)
+    meals = {student_id: (count, due) for student_id, count, due in meals_query}
+    paid = dict(paid_query.all())
+
+    totals = {}
+    for (student_id,) in db.session.query(User.id).filter_by(role='student'):
+        base_meals, base_due, base_paid = base.get(student_id, (0, 0, 0))
+        meals_consumed, due = meals.get(student_id, (0, 0))
+        totals[student_id] = (base_meals + (meals_consumed or 0),
+                              base_due + (due or 0),
+                              base_paid + (paid.get(student_id) or 0))
+    return totals
+
+
+def rebuild_ledgers():
+    """Throw away every ledger row and rebuild them from Meal and Payment."""
+    StudentLedger.query.delete()
+    now = datetime.utcnow()
+    rows = [
+        dict(student_id=student_id, meals_consumed=meals_consumed,
+             total_due=total_due, total_paid=total_paid,
+             balance=total_paid - total_due, last_updated=now)
+        for student_id, (meals_consumed, total_due, total_paid) in compute_totals().items()
+    ]
+    if rows:
+        db.session.execute(db.insert(StudentLedger), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def verify_ledgers():
+    """Return a list of (student_id, stored, expected) tuples that disagree."""
+    stored = {l.student_id: (l.meals_consumed, l.total_due, l.total_paid)
+              for l in StudentLedger.query.all()}
+    mismatches = []
+    for student_id, expected in compute_totals().items():
+        actual = stored.get(student_id, (0, 0, 0))
+        if actual[0] != expected[0] or \
+                abs(actual[1] - expected[1]) > 0.005 or abs(actual[2] - expected[2]) > 0.005:
+            mismatches.append((student_id, stored.get(student_id), expected))
+    return mismatches
+
+
+def month_key(column):
+    """SQL expression turning a date column into its 'YYYY-MM' month."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return db.func.to_char(column, 'YYYY-MM')
+    if dialect in ('mysql', 'mariadb'):
+        return db.func.date_format(column, '%Y-%m')
+    return db.func.strftime('%Y-%m', column)
+
+
+def apply_collection(payment_date, amount, count=1):
+    """Add ``amount`` (and ``count`` payments) to the month of ``payment_date``; negative to remove."""
+    month = payment_date.strftime('%Y-%m')
+    updated = MonthlyCollection.query.filter_by(month=month).update({
+        MonthlyCollection.total_amount: MonthlyCollection.total_amount + amount,
+        MonthlyCollection.payment_count: MonthlyCollection.payment_count + count,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(MonthlyCollection(month=month, total_amount=amount, payment_count=count))
+
+
+def remove_student_collections(student_id):
+    """Take a student's payments (live and archived) out of the monthly rollup before they are deleted."""
+    payments = archive.payment_entity()
+    month = month_key(payments.date)
+    for month_value, total, count in db.session.query(month, db.func.sum(payments.amount), db.func.count(payments.id))\
+                                               .filter(payments.student_id == student_id)\
+                                               .group_by(month):
+        MonthlyCollection.query.filter_by(month=month_value).update({
+            MonthlyCollection.total_amount: MonthlyCollection.total_amount - total,
+            MonthlyCollection.payment_count: MonthlyCollection.payment_count - count,
+        }, synchronize_session=False)
+
+
+def rebuild_monthly_collections():
+    """Recompute the monthly collections rollup from every payment, live and archived."""
+    MonthlyCollection.query.delete()
+    payments = archive.payment_entity()
+    month = month_key(payments.date)
+    rows = [
+        dict(month=month_value, total_amount=total, payment_count=count)
+        for month_value, total, count in db.session.query(month, db.func.sum(payments.amount),
+                                                          db.func.count(payments.id))
+                                                   .group_by(month)
+    ]
+    if rows:
+        db.session.execute(db.insert(MonthlyCollection), rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,513 @@
+"""Meal-time peak load simulator.
+
+Reproduces the busiest minutes of a meal window: students logging in and
+opening their dashboard while mess staff mark attendance as fast as they
+can. Each virtual user is a thread that repeats a visit, then waits a
+random think time (exponential, ``--think`` seconds on average):
+
+* student: ``POST /login``, ``GET /student/dashboard`` and sometimes
+  ``GET /student/attendance``, starting from a fresh session each visit;
+* staff: logged in once as the admin, sometimes reloads
+  ``GET /admin/attendance``, then toggles meals with a single
+  ``POST /admin/attendance`` or a batched ``POST /admin/attendance/bulk``
+  as the attendance page does. Toggles only pick from the first
+  ``--hot-students`` students, so several staff race on the same rows.
+
+The app is driven through the Flask test client (default), a gunicorn
+server started for the run (``--gunicorn WORKERS``) or a server that is
+already running (``--url``). Everything stays on this machine.
+
+For every endpoint the summary reports throughput, latency percentiles,
+the error rate and lock contention: requests that failed on a database
+lock, and the writes ``database.with_retry`` had to retry (read from the
+``Server-Timing`` header). Afterwards the database is checked for duplicate
+Meal rows, ledgers that no longer match the meals and payments, and daily
+headcounts that no longer match the meal tables; the exit status is 1 if
+any turn up.
+
+    python loadtest.py --users 200 --mix student=9,staff=1 --duration 120 --think 2
+    python loadtest.py --gunicorn 4 --users 300 --duration 900 --output before.json
+    python loadtest.py --compare before.json after.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from benchmark import percentile, _git_commit
+
+LOCK_MARKERS = ('locked', 'deadlock', 'could not serialize', 'lock wait timeout')
+RETRY_TIMING = re.compile(r'^retry;desc="(\d+)')
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+# Longer than gunicorn's graceful_timeout (30 s by default), after which its workers are killed anyway
+SHUTDOWN_TIMEOUT = 45
+
+
+class TestClientSession:
+    """One virtual user's cookies and requests, served in this process by the Flask test client."""
+
+    def __init__(self, app):
+        self.app = app
+        self.reset()
+
+    def reset(self):
+        self.client = self.app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        response = self.client.open(path, method=method, data=form, json=json_body)
+        try:
+            return response.status_code, response.get_data(), response.headers.getlist('Server-Timing')
+        finally:
+            response.close()
+
+    def close(self):
+        pass
+
+
+class HTTPSession:
+    """One virtual user's cookies and keep-alive connection to a server on this machine."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = None
+        self.reset()
+
+    def reset(self):
+        self.cookies = SimpleCookie()
+
+    def close(self):
+        # An open keep-alive connection would hold up gunicorn's graceful shutdown
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, method, path, form=None, json_body=None):
+        headers = {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif json_body is not None:
+            body = json.dumps(json_body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={morsel.value}' for name, morsel in self.cookies.items())
+
+        for attempt in (1, 2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                # The server may close an idle keep-alive connection; only a second failure counts
+                if attempt == 2:
+                    return 0, b'', []
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self.cookies.load(header)
+        return response.status, data, response.headers.get_all('Server-Timing') or []
+
+
+class Stats:
+    """Per-endpoint samples shared by every virtual user."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, label, ms, error, lock_error, retries):
+        with self.lock:
+            entry = self.endpoints.setdefault(label, {'latencies': [], 'errors': 0, 'lock_errors': 0,
+                                                      'lock_retries': 0})
+            entry['latencies'].append(ms)
+            entry['errors'] += error
+            entry['lock_errors'] += lock_error
+            entry['lock_retries'] += retries
+
+    def summary(self, seconds):
+        result = {}
+        for label, entry in sorted(self.endpoints.items()):
+            latencies = entry['latencies']
+            result[label] = {
+                'requests': len(latencies),
+                'throughput_rps': round(len(latencies) / seconds, 2),
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'errors': entry['errors'],
+                'error_rate': round(entry['errors'] / len(latencies), 4),
+                'lock_error_rate': round(entry['lock_errors'] / len(latencies), 4),
+                'lock_retries': entry['lock_retries'],
+            }
+        return result
+
+
+def _failure(status, body, expected):
+    """(error, lock_error) for one response."""
+    if status not in expected:
+        text = body.decode('utf-8', 'replace').lower()
+        return True, any(marker in text for marker in LOCK_MARKERS)
+    if not body.startswith(b'{'):
+        return False, False
+    # The attendance endpoints answer 200 with per-change results
+    payload = json.loads(body)
+    results = payload.get('results', [payload])
+    errors = [result.get('error') or '' for result in results if result.get('success') is False]
+    return bool(errors), any(marker in error.lower() for error in errors for marker in LOCK_MARKERS)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, role, session, plan, stats, stop, seed):
+        super().__init__(daemon=True)
+        self.role = role
+        self.session = session
+        self.plan = plan
+        self.stats = stats
+        self.stop = stop
+        self.rng = random.Random(seed)
+        self.logged_in = False
+
+    def call(self, label, method, path, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        status, body, timings = self.session.request(method, path, **kwargs)
+        ms = (time.perf_counter() - started) * 1000
+        error, lock_error = _failure(status, body, expected)
+        retries = sum(int(match.group(1)) for match in map(RETRY_TIMING.match, timings) if match)
+        self.stats.record(label, ms, error, lock_error, retries)
+        return not error
+
+    def login(self, username, password):
+        self.session.reset()
+        # A successful login redirects; a failed one renders the form again with 200
+        return self.call('POST /login', 'POST', '/login', expected=(302,),
+                         form={'username': username, 'password': password})
+
+    def student_visit(self):
+        username = self.rng.choice(self.plan['students'])
+        if not self.login(username, self.plan['student_password']):
+            return
+        self.call('GET /student/dashboard', 'GET', '/student/dashboard')
+        if self.rng.random() < 0.3:
+            self.call('GET /student/attendance', 'GET', '/student/attendance')
+
+    def change(self):
+        return {'student_id': self.rng.choice(self.plan['hot_students']), 'date': self.plan['date'],
+                'meal_type': self.plan['meal'], 'action': self.rng.choice(('mark', 'unmark'))}
+
+    def staff_visit(self):
+        if not self.logged_in:
+            self.logged_in = self.login('admin', self.plan['admin_password'])
+            if not self.logged_in:
+                return
+        if self.rng.random() < 0.1:
+            self.call('GET /admin/attendance', 'GET', f"/admin/attendance?date={self.plan['date']}")
+        if self.rng.random() < 0.5:
+            self.call('POST /admin/attendance', 'POST', '/admin/attendance', form=self.change())
+        else:
+            self.call('POST /admin/attendance/bulk', 'POST', '/admin/attendance/bulk',
+                      json_body={'changes': [self.change() for _ in range(self.plan['batch_size'])]})
+
+    def run(self):
+        visit = self.student_visit if self.role == 'student' else self.staff_visit
+        while not self.stop.is_set():
+            visit()
+            think = self.plan['think']
+            if think:
+                self.stop.wait(self.rng.expovariate(1 / think))
+
+
+def parse_mix(text):
+    """'student=9,staff=1' -> {'student': 9.0, 'staff': 1.0}."""
+    mix = {}
+    for part in text.split(','):
+        role, _, weight = part.partition('=')
+        if role not in ('student', 'staff'):
+            raise argparse.ArgumentTypeError(f'Unknown role in --mix: {role}')
+        mix[role] = float(weight or 1)
+    if not sum(mix.values()):
+        raise argparse.ArgumentTypeError('--mix needs a positive weight')
+    return mix
+
+
+def assign_roles(users, mix):
+    """Split ``users`` between the roles in proportion to ``mix``, at least one each."""
+    total = sum(mix.values())
+    staff = round(users * mix.get('staff', 0) / total)
+    if mix.get('staff') and users > 1:
+        staff = max(1, staff)
+    if mix.get('student') and staff == users and users > 1:
+        staff -= 1
+    return ['staff'] * staff + ['student'] * (users - staff)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, worker_class, log_path):
+    """Start gunicorn on a free local port with this run's DATABASE_URL; returns (process, url)."""
+    port = _free_port()
+    env = dict(os.environ, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers))
+    log = open(log_path, 'w')
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+    if worker_class:
+        command += ['-k', worker_class]
+    process = subprocess.Popen(command,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}; see {log_path}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn did not start listening within a minute; see {log_path}')
+
+
+def stop_gunicorn(process):
+    """Stop gunicorn gracefully, killing it if the workers outlast ``SHUTDOWN_TIMEOUT``."""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=SHUTDOWN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def check_consistency(app, day):
+    """Look for damage racing writes can do; returns a JSON-ready dict."""
+    import headcounts
+    from ledger import verify_ledgers
+    from migrations import duplicate_meals
+
+    with app.app_context():
+        duplicates = duplicate_meals()
+        ledgers = verify_ledgers()
+        headcount_days = headcounts.verify(day, day)
+    return {
+        'duplicate_meals': len(duplicates),
+        'duplicate_examples': [{'student_id': student_id, 'date': meal_date.isoformat(), 'rows': rows}
+                               for student_id, meal_date, rows in duplicates[:10]],
+        'ledger_mismatches': len(ledgers),
+        'headcount_mismatches': [{'date': meal_date.isoformat(), 'stored': stored, 'expected': expected}
+                                 for meal_date, stored, expected in headcount_days],
+    }
+
+
+def run(args):
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    elif args.url:
+        print('--url needs --database-url pointing at the database the server uses.', file=sys.stderr)
+        return 2
+    else:
+        # The app reads DATABASE_URL when it is imported, so set it first
+        database = os.path.join(tempfile.mkdtemp(prefix='mess-load-'), 'load.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    from app import create_app
+    from models import db, User
+    import seed
+
+    app = create_app() if not (args.url or args.gunicorn) else create_app(web=False)
+    with app.app_context():
+        if not args.no_seed:
+            try:
+                seed.generate(students=args.students, days=args.days, seed=args.seed)
+            except ValueError as e:
+                print(f'{e} (or pass --no-seed).', file=sys.stderr)
+                return 2
+        students = db.session.query(User.id, User.username).filter_by(role='student').order_by(User.id).all()
+    if not students:
+        print('The database has no students; run without --no-seed.', file=sys.stderr)
+        return 2
+
+    day = date.today()
+    plan = {
+        'students': [username for _, username in students],
+        'hot_students': [student_id for student_id, _ in students[:args.hot_students]],
+        'student_password': args.student_password,
+        'admin_password': args.admin_password,
+        'date': day.isoformat(),
+        'meal': args.meal,
+        'batch_size': args.batch_size,
+        'think': args.think,
+    }
+
+    server = None
+    if args.gunicorn:
+        log_path = os.path.join(tempfile.mkdtemp(prefix='mess-load-'), 'gunicorn.log')
+        server, url = start_gunicorn(args.gunicorn, args.worker_class, log_path)
+        print(f'gunicorn with {args.gunicorn} workers at {url}, log in {log_path}', file=sys.stderr)
+    else:
+        url = args.url
+
+    def new_session():
+        return HTTPSession(url) if url else TestClientSession(app)
+
+    stats = Stats()
+    stop = threading.Event()
+    roles = assign_roles(args.users, args.mix)
+    users = [VirtualUser(role, new_session(), plan, stats, stop, seed=args.seed * 100003 + index)
+             for index, role in enumerate(roles)]
+    try:
+        started = time.perf_counter()
+        for index, user in enumerate(users):
+            user.start()
+            # Spread the arrivals over the ramp-up instead of starting every user at once
+            if args.ramp_up and index < len(users) - 1:
+                time.sleep(args.ramp_up / len(users))
+        stop.wait(max(0, args.duration - (time.perf_counter() - started)))
+        stop.set()
+        for user in users:
+            user.join()
+        for user in users:
+            user.session.close()
+        seconds = time.perf_counter() - started
+
+        endpoints = stats.summary(seconds)
+        requests_total = sum(entry['requests'] for entry in endpoints.values())
+        consistency = check_consistency(app, day)
+        summary = {
+            'meta': {
+                'commit': _git_commit(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'target': 'gunicorn' if args.gunicorn else ('url' if args.url else 'test-client'),
+                'gunicorn_workers': args.gunicorn,
+                'users': dict(staff=roles.count('staff'), student=roles.count('student')),
+                'think_seconds': args.think,
+                'ramp_up_seconds': args.ramp_up,
+                'duration_seconds': round(seconds, 2),
+                'dataset': (dict(students=args.students, days=args.days, seed=args.seed)
+                            if not args.no_seed else None),
+                'meal': args.meal,
+                'hot_students': len(plan['hot_students']),
+                'batch_size': args.batch_size,
+            },
+            'total': {
+                'requests': requests_total,
+                'throughput_rps': round(requests_total / seconds, 2),
+                'errors': sum(entry['errors'] for entry in endpoints.values()),
+                'lock_retries': sum(entry['lock_retries'] for entry in endpoints.values()),
+            },
+            'endpoints': endpoints,
+            'consistency': consistency,
+        }
+
+        if not args.quiet:
+            print(f"{'endpoint':28} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} "
+                  f"{'locks':>7} {'retries':>7}", file=sys.stderr)
+            for label, entry in endpoints.items():
+                print(f"{label:28} {entry['throughput_rps']:8.1f} {entry['p50_ms']:9.1f} {entry['p95_ms']:9.1f} "
+                      f"{entry['p99_ms']:9.1f} {entry['error_rate']:7.1%} {entry['lock_error_rate']:7.1%} "
+                      f"{entry['lock_retries']:7}", file=sys.stderr)
+            print(f"duplicate meal rows: {consistency['duplicate_meals']}, ledger mismatches: "
+                  f"{consistency['ledger_mismatches']}, headcount mismatches: "
+                  f"{len(consistency['headcount_mismatches'])}", file=sys.stderr)
+
+        output = json.dumps(summary, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+        damaged = consistency['duplicate_meals'] or consistency['ledger_mismatches'] or \
+            consistency['headcount_mismatches']
+        return 1 if damaged else 0
+    finally:
+        stop.set()
+        if server is not None:
+            stop_gunicorn(server)
+
+
+def compare(before_path, after_path):
+    """Print the change in throughput, p95 latency and error rates for each endpoint in two summaries."""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    for key in ('users', 'think_seconds', 'dataset', 'target', 'gunicorn_workers'):
+        if before['meta'].get(key) != after['meta'].get(key):
+            print(f'Warning: the two runs used a different {key}.', file=sys.stderr)
+
+    print(f"{'endpoint':28} {'req/s':>23} {'p95 ms':>23} {'errors':>17} {'locks':>17}")
+    for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old, new = before['endpoints'].get(name), after['endpoints'].get(name)
+        if not old or not new:
+            print(f"{name:28} only in {'after' if new else 'before'}")
+            continue
+
+        def change(key, width=23):
+            a, b = old[key], new[key]
+            ratio = f" ({b / a:.2f}x)" if a else ''
+            return f"{f'{a} -> {b}{ratio}':>{width}}"
+        errors = f"{old['error_rate']:.1%} -> {new['error_rate']:.1%}"
+        locks = f"{old['lock_error_rate']:.1%} -> {new['lock_error_rate']:.1%}"
+        print(f"{name:28} {change('throughput_rps')} {change('p95_ms')} {errors:>17} {locks:>17}")
+    print(f"{'total':28} {before['total']['throughput_rps']} -> {after['total']['throughput_rps']} req/s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate meal-time login and attendance traffic')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent virtual users (default: 50)')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('student=9,staff=1'),
+                        help='Relative share of each role (default: student=9,staff=1)')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='Mean seconds a user waits between visits, 0 for none (default: 1)')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run (default: 60)')
+    parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which users start (default: 5)')
+    parser.add_argument('--meal', choices=MEAL_TYPES, default='lunch', help='Meal the staff mark (default: lunch)')
+    parser.add_argument('--hot-students', type=int, default=25,
+                        help='Staff only toggle the first N students, so their writes collide (default: 25)')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help='Changes per bulk attendance request (default: 10)')
+    parser.add_argument('--students', type=int, default=500, help='Students to seed (default: 500)')
+    parser.add_argument('--days', type=int, default=30, help='Days of attendance to seed (default: 30)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-seed', action='store_true', help='Use the existing data in --database-url')
+    parser.add_argument('--database-url',
+                        help='Database to load (default: a new temporary SQLite file); also read for the checks')
+    parser.add_argument('--student-password', default='student')
+    parser.add_argument('--admin-password', default='admin')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--gunicorn', type=int, metavar='WORKERS',
+                        help='Serve the app with gunicorn and this many workers instead of the test client')
+    target.add_argument('--url', help='Load a server that is already running on this machine')
+    parser.add_argument('--worker-class', help='gunicorn worker class (default: gthread, from gunicorn.conf.py)')
+    parser.add_argument('--output', help='Write the JSON summary here instead of stdout')
+    parser.add_argument('--quiet', action='store_true', help='Do not print the per-endpoint table')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two JSON summaries instead of running')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
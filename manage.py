@@ -0,0 +1,153 @@
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+
+from app import create_app
+from ledger import rebuild_ledgers, verify_ledgers, rebuild_monthly_collections
+from migrations import upgrade
+import archive
+import seed
+import assets
+import headcounts
+
+# Maintenance commands only touch the database; the views and their imports are skipped
+app = create_app(web=False)
+
+
+def rebuild_ledger_command(args):
+    count = rebuild_ledgers()
+    print(f"Rebuilt ledger for {count} students.")
+    return 0
+
+
+def verify_ledger_command(args):
+    mismatches = verify_ledgers()
+    for student_id, stored, expected in mismatches:
+        print(f"Student {student_id}: ledger={stored} expected={expected}")
+    if mismatches:
+        print(f"{len(mismatches)} ledger rows are out of date. Run 'python manage.py rebuild-ledger'.")
+        return 1
+    print("Ledger is consistent with meals and payments.")
+    return 0
+
+
+def rebuild_collections_command(args):
+    count = rebuild_monthly_collections()
+    print(f"Rebuilt monthly collections for {count} months.")
+    return 0
+
+
+def rebuild_headcounts_command(args):
+    count = headcounts.rebuild()
+    print(f"Rebuilt daily headcounts for {count} days.")
+    return 0
+
+
+def migrate_command(args):
+    removed = upgrade()
+    print(f"Removed {removed} duplicate meal rows and created missing indexes.")
+    # Duplicates were counted twice by the ledger (or the summaries may not exist yet), so recompute them
+    rebuild_collections_command(args)
+    rebuild_headcounts_command(args)
+    return rebuild_ledger_command(args)
+
+
+def checkpoint_command(args):
+    if args.date:
+        try:
+            closing_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            print("--date must be YYYY-MM-DD.")
+            return 1
+    else:
+        # Default to the last day of the previous month
+        closing_date = date.today().replace(day=1) - timedelta(days=1)
+    try:
+        count = archive.create_checkpoint(closing_date)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Checkpointed {count} student balances through {closing_date}.")
+    return 0
+
+
+def archive_command(args):
+    try:
+        meals, payments = archive.archive_closed_rows()
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Archived {meals} meal rows and {payments} payment rows through {archive.closed_through()}.")
+    return 0
+
+
+def seed_command(args):
+    try:
+        counts = seed.generate(students=args.students, days=args.days,
+                               payment_every=args.payment_every, seed=args.seed)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Created {counts['students']} students, {counts['meals']} meal rows and {counts['payments']} payments.")
+    return 0
+
+
+def build_assets_command(args):
+    manifest = assets.build(app.static_folder)
+    print(f"Fingerprinted {len(manifest)} static files into static/{assets.DIST}/.")
+    if assets.brotli is None:
+        print("brotli is not installed; wrote gzip variants only.")
+    return 0
+
+
+def sweep_exports_command(args):
+    import export_jobs
+
+    removed = export_jobs.sweep()
+    print(f"Removed {removed} expired export files.")
+    return 0
+
+
+COMMANDS = {
+    'migrate': (migrate_command, 'Upgrade an existing database: deduplicate meals and add indexes'),
+    'rebuild-ledger': (rebuild_ledger_command, 'Recompute every student ledger from meals and payments'),
+    'verify-ledger': (verify_ledger_command, 'Compare student ledgers against meals and payments'),
+    'rebuild-collections': (rebuild_collections_command, 'Recompute the monthly collections summary from payments'),
+    'rebuild-headcounts': (rebuild_headcounts_command, 'Recompute the daily headcount rollup from meals'),
+    'checkpoint': (checkpoint_command, 'Close student balances through a date (default: end of last month)'),
+    'archive': (archive_command, 'Move meal and payment rows covered by the latest checkpoint to the archive tables'),
+    'build-assets': (build_assets_command, 'Write fingerprinted, precompressed copies of the static files'),
+    'sweep-exports': (sweep_exports_command, 'Delete background export files past their retention period'),
+    'seed': (seed_command, 'Fill an empty database with generated students, attendance and payments'),
+}
+
+# Extra command-line options, as (flags, keyword arguments) for add_argument
+ARGUMENTS = {
+    'checkpoint': [
+        (('--date',), dict(help='Closing date (YYYY-MM-DD)')),
+    ],
+    'seed': [
+        (('--students',), dict(type=int, default=200, help='Number of students (default: 200)')),
+        (('--days',), dict(type=int, default=90, help='Days of attendance ending yesterday (default: 90)')),
+        (('--payment-every',), dict(type=int, default=30, help='Days between payments (default: 30)')),
+        (('--seed',), dict(type=int, default=42, help='Random seed (default: 42)')),
+    ],
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mess management maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (handler, help_text) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.set_defaults(handler=handler)
+        for flags, options in ARGUMENTS.get(name, ()):
+            subparser.add_argument(*flags, **options)
+
+    args = parser.parse_args(argv)
+    with app.app_context():
+        return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Per-request SQL instrumentation and rolling per-endpoint metrics.
+
+SQLAlchemy engine events count every statement a request runs, time it,
+and group statements by a fingerprint (the SQL with literals and ``IN``
+lists collapsed). After each request:
+
+* a ``Server-Timing`` header reports database time, statement count and
+  total time (plus any writes retried after a lock error, see
+  ``database.with_retry``), so browser dev tools show them next to the request;
+* a warning is logged when one fingerprint ran ``METRICS_N_PLUS_ONE_THRESHOLD``
+  times or more, which is what a query inside a loop looks like;
+* the request joins a rolling window of the last ``METRICS_WINDOW`` samples
+  for its endpoint, shown as histograms on ``/admin/metrics``.
+
+Samples live in this worker's memory, so each worker reports only the
+requests it served. Statements that run while a streamed response is being
+sent are not counted, because the headers have already gone out.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+_samples = {}
+_lock = threading.Lock()
+_registered = False
+_config = {'window': 1000, 'threshold': 10}
+
+
+def fingerprint(statement):
+    """Normalise a SQL statement so repeats with different parameters compare equal."""
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _IN_LIST.sub('(?, ...)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or not conn.info.get('metrics_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    state = g.get('sql_metrics')
+    if state is not None:
+        state['count'] += 1
+        state['seconds'] += elapsed
+        state['fingerprints'][fingerprint(statement)] += 1
+
+
+def _handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _before_request():
+    g.request_started = time.perf_counter()
+    g.sql_metrics = {'count': 0, 'seconds': 0.0, 'fingerprints': Counter()}
+
+
+def _after_request(response):
+    state = g.get('sql_metrics')
+    started = g.get('request_started')
+    if state is None or started is None:
+        return response
+
+    total_ms = (time.perf_counter() - started) * 1000
+    db_ms = state['seconds'] * 1000
+    response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{state["count"]} queries"')
+    response.headers.add('Server-Timing', f'app;dur={total_ms:.1f}')
+    if g.get('db_retries'):
+        response.headers.add('Server-Timing', f'retry;desc="{g.db_retries} lock retries"')
+
+    endpoint = request.endpoint or 'unmatched'
+    repeated = state['fingerprints'].most_common(1)
+    suspect = repeated and repeated[0][1] >= _config['threshold']
+    if suspect:
+        logger.warning('Possible N+1 in %s %s: statement ran %d times: %s',
+                       request.method, endpoint, repeated[0][1], repeated[0][0][:300])
+
+    _record(endpoint, total_ms, db_ms, state['count'], repeated[0] if suspect else None)
+    return response
+
+
+def _record(endpoint, total_ms, db_ms, statements, suspect):
+    with _lock:
+        entry = _samples.get(endpoint)
+        if entry is None:
+            entry = _samples[endpoint] = {'samples': deque(maxlen=_config['window']),
+                                          'requests': 0, 'n_plus_one': Counter()}
+        entry['samples'].append((total_ms, db_ms, statements))
+        entry['requests'] += 1
+        if suspect:
+            entry['n_plus_one'][suspect[0]] = max(entry['n_plus_one'][suspect[0]], suspect[1])
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def summary():
+    """Per-endpoint statistics over the rolling window, busiest endpoint first."""
+    with _lock:
+        snapshot = {endpoint: (list(entry['samples']), entry['requests'], entry['n_plus_one'].most_common(5))
+                    for endpoint, entry in _samples.items()}
+
+    endpoints = []
+    for endpoint, (samples, requests, suspects) in snapshot.items():
+        if not samples:
+            continue
+        totals = sorted(sample[0] for sample in samples)
+        histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        for total_ms in totals:
+            histogram[next((i for i, bound in enumerate(LATENCY_BUCKETS) if total_ms <= bound),
+                           len(LATENCY_BUCKETS))] += 1
+        endpoints.append({
+            'endpoint': endpoint,
+            'requests': requests,
+            'window': len(samples),
+            'p50_ms': round(_percentile(totals, 50), 1),
+            'p95_ms': round(_percentile(totals, 95), 1),
+            'max_ms': round(totals[-1], 1),
+            'avg_db_ms': round(sum(sample[1] for sample in samples) / len(samples), 1),
+            'avg_statements': round(sum(sample[2] for sample in samples) / len(samples), 1),
+            'max_statements': max(sample[2] for sample in samples),
+            'histogram': histogram,
+            'n_plus_one': [{'statement': statement, 'count': count} for statement, count in suspects],
+        })
+    endpoints.sort(key=lambda item: item['requests'], reverse=True)
+    return endpoints
+
+
+def bucket_labels():
+    labels = [f'≤{bound}' for bound in LATENCY_BUCKETS]
+    return labels + [f'>{LATENCY_BUCKETS[-1]}']
+
+
+def init_app(app):
+    """Install the engine listeners (once per process) and this app's request hooks."""
+    global _registered
+    _config['window'] = app.config['METRICS_WINDOW']
+    _config['threshold'] = app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+    if not app.config['METRICS_ENABLED']:
+        return
+    if not _registered:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _registered = True
+    app.before_request(_before_request)
+    app.after_request(_after_request)
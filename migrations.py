@@ -0,0 +1,70 @@
+"""Schema upgrades for databases created by an older version of the app.
+
+``db.create_all()`` only creates missing tables; it never adds indexes to a
+table that already exists. ``upgrade`` fills that gap and is safe to run
+repeatedly.
+"""
+from models import db, User, Meal, Payment, MealArchive, PaymentArchive
+
+
+def duplicate_meals():
+    """(student_id, date, rows) for every student and day with more than one Meal row."""
+    return db.session.query(Meal.student_id, Meal.date, db.func.count(Meal.id))\
+                     .group_by(Meal.student_id, Meal.date)\
+                     .having(db.func.count(Meal.id) > 1)\
+                     .all()
+
+
+def deduplicate_meals():
+    """Merge duplicate (student_id, date) Meal rows into the oldest one.
+
+    Flags are OR-ed together so no recorded meal is lost. Returns the number
+    of rows removed.
+    """
+    duplicates = db.session.query(Meal.student_id, Meal.date, db.func.min(Meal.id),
+                                  db.func.max(db.cast(Meal.breakfast, db.Integer)),
+                                  db.func.max(db.cast(Meal.lunch, db.Integer)),
+                                  db.func.max(db.cast(Meal.dinner, db.Integer)))\
+                           .group_by(Meal.student_id, Meal.date)\
+                           .having(db.func.count(Meal.id) > 1)\
+                           .all()
+
+    removed = 0
+    for student_id, meal_date, keep_id, breakfast, lunch, dinner in duplicates:
+        Meal.query.filter_by(id=keep_id).update({
+            Meal.breakfast: bool(breakfast),
+            Meal.lunch: bool(lunch),
+            Meal.dinner: bool(dinner),
+        }, synchronize_session=False)
+        removed += Meal.query.filter(Meal.student_id == student_id,
+                                     Meal.date == meal_date,
+                                     Meal.id != keep_id)\
+                             .delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def fill_empty_student_fields():
+    """Replace NULL names and room numbers with '' (older databases allowed NULL)."""
+    filled = 0
+    for column in (User.name, User.room_no):
+        filled += User.query.filter(column.is_(None)).update({column: ''}, synchronize_session=False)
+    db.session.commit()
+    return filled
+
+
+def create_indexes():
+    """Create any index declared on the models that the database is missing."""
+    for table in (User.__table__, Meal.__table__, Payment.__table__, MealArchive.__table__,
+                  PaymentArchive.__table__):
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def upgrade():
+    """Bring an existing database up to the current schema; returns duplicate meals removed."""
+    db.create_all()
+    removed = deduplicate_meals()
+    fill_empty_student_fields()
+    create_indexes()
+    return removed
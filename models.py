@@ -11,14 +11,21 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(120), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # admin, student, staff
     
-    # Student-specific fields
-    name = db.Column(db.String(100))
+    # Student-specific fields; name and room_no are '' rather than NULL so keyset pages can seek on them
+    name = db.Column(db.String(100), nullable=False, default='')
     roll_no = db.Column(db.String(20), unique=True)
-    room_no = db.Column(db.String(10))
+    room_no = db.Column(db.String(10), nullable=False, default='')
     contact = db.Column(db.String(15))
     
     meals = db.relationship('Meal', backref='student', lazy=True)
     payments = db.relationship('Payment', backref='student', lazy=True)
+
+    __table_args__ = (
+        # Keyset pages of the student list, one per sort order
+        db.Index('ix_user_role_name', 'role', 'name', 'id'),
+        db.Index('ix_user_role_roll_no', 'role', 'roll_no', 'id'),
+        db.Index('ix_user_role_room_no', 'role', 'room_no', 'id'),
+    )
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -34,9 +41,100 @@ class Meal(db.Model):
     dinner = db.Column(db.Boolean, default=False)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    __table_args__ = (
+        # One attendance row per student per day; also serves per-student lookups
+        db.Index('ix_meal_student_date', 'student_id', 'date', unique=True),
+        db.Index('ix_meal_date', 'date'),
+    )
+
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False, default=date.today)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='pending')  # pending, paid
-    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
\ No newline at end of file
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_payment_student_date', 'student_id', 'date'),
+        db.Index('ix_payment_date', 'date'),
+        db.Index('ix_payment_amount', 'amount', 'id'),
+    )
+
+class StudentLedger(db.Model):
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    meals_consumed = db.Column(db.Integer, nullable=False, default=0)
+    total_due = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+    balance = db.Column(db.Float, nullable=False, default=0)  # total_paid - total_due
+    last_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    student = db.relationship('User', backref=db.backref('ledger', uselist=False))
+
+class MonthlyCollection(db.Model):
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+
+class Checkpoint(db.Model):
+    closing_date = db.Column(db.Date, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    archived = db.Column(db.Boolean, nullable=False, default=False)  # rows up to closing_date moved to the archive tables
+
+class BalanceCheckpoint(db.Model):
+    # Each student's cumulative totals for everything up to and including closing_date
+    closing_date = db.Column(db.Date, db.ForeignKey('checkpoint.closing_date'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    meals_consumed = db.Column(db.Integer, nullable=False, default=0)
+    total_due = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+
+# Same columns as Meal and Payment; rows keep their original ids when archived
+
+class MealArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    breakfast = db.Column(db.Boolean, default=False)
+    lunch = db.Column(db.Boolean, default=False)
+    dinner = db.Column(db.Boolean, default=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_meal_archive_student_date', 'student_id', 'date'),
+        db.Index('ix_meal_archive_date', 'date'),
+    )
+
+class PaymentArchive(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), default='pending')
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_payment_archive_student_date', 'student_id', 'date'),
+        db.Index('ix_payment_archive_date', 'date'),
+    )
+
+class DailyHeadcount(db.Model):
+    # Meals taken per date across all students, live and archived; see headcounts.py
+    date = db.Column(db.Date, primary_key=True)
+    breakfast = db.Column(db.Integer, nullable=False, default=0)
+    lunch = db.Column(db.Integer, nullable=False, default=0)
+    dinner = db.Column(db.Integer, nullable=False, default=0)
+
+class DataVersion(db.Model):
+    # Bumped in the same transaction as every commit that changes the table; '*' counts all of them
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Tariff(db.Model):
+    # Rate of one meal type from effective_from until the next tariff for that meal
+    id = db.Column(db.Integer, primary_key=True)
+    meal_type = db.Column(db.String(10), nullable=False)  # breakfast, lunch, dinner
+    rate = db.Column(db.Float, nullable=False)
+    effective_from = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('meal_type', 'effective_from', name='uq_tariff_meal_date'),
+    )
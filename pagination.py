@@ -0,0 +1,126 @@
+"""Keyset (seek) pagination for the admin tables.
+
+Instead of OFFSET, each page remembers the sort key of its first and last
+row in an opaque cursor, and the next page asks the database for rows
+strictly after (or before) that key. With an index on the sort columns the
+cost of a page does not depend on how far into the table it is, so sort on
+the raw, indexed columns rather than expressions over them. NULLs in the
+leading sort column are ordered before every other value.
+"""
+import base64
+import json
+from datetime import date
+
+from flask import current_app, request
+
+from models import db, User
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    data = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    """Turn a cursor back into sort key values, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [date.fromisoformat(v) if isinstance(column.type, db.Date) and v is not None else v
+                for column, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+def page_args():
+    """Read per_page, after and before from the query string."""
+    default = current_app.config['PAGE_SIZE']
+    per_page = request.args.get('per_page', default, type=int) or default
+    per_page = max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+    return per_page, request.args.get('after'), request.args.get('before')
+
+
+def paginate(query, columns, per_page, after=None, before=None, descending=False, key=None):
+    """Return one KeysetPage of ``query`` ordered by ``columns``.
+
+    ``columns`` are SQL expressions that together identify a row uniquely
+    (end with a primary key). ``key`` extracts the same values from a result
+    row; by default they are read from the row in the same order, which
+    works when the query selects the sort columns first.
+    """
+    key = key or (lambda row: [row[i] for i in range(len(columns))])
+    after_values = decode_cursor(after, columns)
+    before_values = decode_cursor(before, columns) if after_values is None else None
+    backwards = before_values is not None
+
+    if after_values is not None:
+        query = query.filter(_seek(columns, after_values, later=not descending))
+    elif backwards:
+        query = query.filter(_seek(columns, before_values, later=descending))
+
+    # Walking backwards means reading the index in the opposite direction
+    ascending = descending == backwards
+    order = [column.asc().nulls_first() if ascending else column.desc().nulls_last() for column in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows)
+
+    has_next = more if not backwards else True
+    has_prev = more if backwards else after_values is not None
+    return KeysetPage(rows,
+                      next_cursor=encode_cursor(key(rows[-1])) if has_next else None,
+                      prev_cursor=encode_cursor(key(rows[0])) if has_prev else None)
+
+
+def _seek(columns, values, later):
+    # Rows after (``later``) or before ``values`` in ascending order, NULLs in the leading column first.
+    # Row values keep the common case a single range on the index.
+    leading, value = columns[0], values[0]
+    if value is not None:
+        beyond = db.tuple_(*columns) > db.tuple_(*values) if later else db.tuple_(*columns) < db.tuple_(*values)
+        if later or not getattr(getattr(leading, 'expression', leading), 'nullable', True):
+            return beyond
+        return db.or_(leading.is_(None), beyond)
+    rest, rest_values = db.tuple_(*columns[1:]), db.tuple_(*values[1:])
+    if later:
+        return db.or_(leading.is_not(None), db.and_(leading.is_(None), rest > rest_values))
+    return db.and_(leading.is_(None), rest < rest_values)
+
+
+def filter_students(query, search):
+    # Case-insensitive match on name, roll number or room number
+    if search:
+        pattern = f"%{search.strip()}%"
+        query = query.filter(db.or_(User.name.ilike(pattern),
+                                    User.roll_no.ilike(pattern),
+                                    User.room_no.ilike(pattern)))
+    return query
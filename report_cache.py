@@ -0,0 +1,144 @@
+"""Conditional GET and a rendered-output cache for reports and exports.
+
+A report response gets an ``ETag`` built from everything its content
+depends on: the endpoint and its query string, the data versions of the
+tables the report reads (see ``data_versions``), the meal rates (see
+``tariffs``) and the templates. A browser that sends the ETag back in ``If-None-Match`` gets a
+304 after one small version lookup, without any report query.
+
+Ranges that end on or before the latest balance checkpoint are closed:
+their attendance can no longer change and payments are always recorded
+for today. Their ETag therefore depends only on the user table (names and
+deletions), and their rendered bytes are kept in a small per-worker LRU so
+other admins are served without re-running the report.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request, session
+
+import archive
+import data_versions
+import tariffs
+
+# Tables whose changes can alter each report
+REPORT_TABLES = {
+    'attendance': ('meal', 'user'),
+    'defaulters': ('meal', 'payment', 'user'),
+    'collections': ('payment',),
+    'payments': ('payment', 'user'),
+}
+CLOSED_TABLES = ('user',)
+CACHED_HEADERS = ('Content-Type', 'Content-Disposition', 'Content-Encoding', 'Vary')
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_template_fingerprint = ''
+_hits = _misses = 0
+
+
+def _fingerprint_templates(folder):
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:12]
+
+
+def is_closed(end_date):
+    closed = archive.closed_through()
+    return closed is not None and end_date <= closed
+
+
+def compute_etag(report_type, end_date, variant=''):
+    """ETag for the current request to a report over a range ending at ``end_date``."""
+    closed = is_closed(end_date)
+    versions = data_versions.current(CLOSED_TABLES if closed else REPORT_TABLES.get(report_type, ()))
+    parts = [request.endpoint, variant, str(closed), _template_fingerprint,
+             tariffs.fingerprint(),
+             *(f'{key}={value}' for key, value in sorted(request.args.items(multi=True))),
+             *(f'{table}:{version}' for table, version in sorted(versions.items()))]
+    return hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:24], closed
+
+
+def _finish(response, etag):
+    response.set_etag(etag)
+    # Browsers may keep a copy but must revalidate it; the 304 is cheap
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _store(etag, body, headers, max_entries):
+    with _lock:
+        _cache[etag] = (body, headers)
+        _cache.move_to_end(etag)
+        while len(_cache) > max_entries:
+            _cache.popitem(last=False)
+
+
+def _tee(chunks, etag, headers, limit, max_entries):
+    # Pass streamed chunks through, keeping a copy while it stays under the size limit.
+    # This runs after the view returned, outside the app context.
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            size += len(chunk)
+            if size <= limit:
+                kept.append(chunk)
+            else:
+                kept = None
+        yield chunk
+    if kept is not None:
+        _store(etag, b''.join(kept), headers, max_entries)
+
+
+def respond(report_type, end_date, build, variant=''):
+    """Serve a report: 304 if the client is current, cached bytes for a closed range, else ``build()``.
+
+    ``build`` returns the Response to send; ``variant`` distinguishes
+    representations of the same URL (e.g. gzip or not).
+    """
+    global _hits, _misses
+    if session.get('_flashes'):
+        # The page will show one-off messages, so it is neither cacheable nor a repeat
+        return build()
+    etag, closed = compute_etag(report_type, end_date, variant)
+    if request.if_none_match.contains(etag):
+        return _finish(Response(status=304), etag)
+
+    if closed:
+        with _lock:
+            cached = _cache.get(etag)
+            if cached:
+                _cache.move_to_end(etag)
+        if cached:
+            _hits += 1
+            body, headers = cached
+            return _finish(Response(body, headers=headers), etag)
+        _misses += 1
+
+    response = build()
+    if closed and response.status_code == 200:
+        headers = [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers]
+        limit = current_app.config['REPORT_CACHE_MAX_BYTES']
+        max_entries = current_app.config['REPORT_CACHE_SIZE']
+        if response.is_streamed:
+            response.response = _tee(response.response, etag, headers, limit, max_entries)
+        elif response.content_length is not None and response.content_length <= limit:
+            _store(etag, response.get_data(), headers, max_entries)
+    return _finish(response, etag)
+
+
+def stats():
+    with _lock:
+        size = len(_cache)
+    return {'entries': size, 'hits': _hits, 'misses': _misses}
+
+
+def init_app(app):
+    global _template_fingerprint
+    _template_fingerprint = _fingerprint_templates(os.path.join(app.root_path, app.template_folder))
+    data_versions.register()
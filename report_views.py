@@ -0,0 +1,172 @@
+"""Report pages and exports.
+
+``reports`` (and the attendance matrix with NumPy behind it) and
+``export_jobs`` are imported inside the views, so a worker only pays for
+them when the first report is asked for.
+"""
+from datetime import datetime, date, timedelta
+
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, \
+    stream_with_context, send_from_directory, abort, make_response, current_app
+from flask_login import login_required, current_user
+
+from models import db, User
+from pagination import paginate, page_args, filter_students
+import report_cache
+
+bp = Blueprint('reports', __name__, url_prefix='/admin')
+
+
+@bp.route('/reports')
+@login_required
+def report():
+    import reports
+    import export_jobs
+
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+
+    report_type = request.args.get('type', 'attendance')
+    start_date_str = request.args.get('start_date', (date.today() - timedelta(days=7)).strftime('%Y-%m-%d'))
+    end_date_str = request.args.get('end_date', date.today().strftime('%Y-%m-%d'))
+
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    search = request.args.get('q', '')
+    per_page, after, before = page_args()
+
+    data = {
+        'report_type': report_type,
+        'start_date': start_date,
+        'end_date': end_date,
+        'search': search,
+        # Only offered when openpyxl is installed
+        'xlsx_export': export_jobs.HAVE_OPENPYXL,
+    }
+
+    def render_report():
+        if report_type == 'attendance' and \
+                (end_date - start_date).days + 1 > current_app.config['ATTENDANCE_MATRIX_THRESHOLD_DAYS']:
+            # Long ranges are summarised from the attendance matrix instead of listing every row
+            data['summary'] = reports.attendance_summary(start_date, end_date)
+            query, keys = reports.summary_student_rows()
+            data['page'] = paginate(filter_students(query, search), keys, per_page, after, before,
+                                    key=lambda row: [row.name, row.student_id])
+            data['summary_students'] = reports.add_meal_totals(data['page'], start_date, end_date)
+
+        elif report_type == 'attendance':
+            # Fetch one page of meal rows (with the student's name and roll number) within the date range
+            query, keys = reports.attendance_rows(start_date, end_date)
+            data['meals'] = data['page'] = paginate(filter_students(query, search), keys, per_page, after, before)
+    
+        elif report_type == 'defaulters':
+            # The balance is what the student paid minus what they owe within the range
+            query = filter_students(reports.dues_query(start_date, end_date, defaulters_only=True), search)
+            data['defaulters'] = data['page'] = paginate(
+                query, [User.name, User.id], per_page, after, before,
+                key=lambda row: [row.name, row.student_id])
+    
+        elif report_type == 'collections':
+            data['collections'] = reports.monthly_collections(start_date, end_date)
+
+        elif report_type == 'payments':
+            query, keys = reports.payment_rows(start_date, end_date)
+            data['payments'] = data['page'] = paginate(filter_students(query, search), keys, per_page, after, before)
+
+        return make_response(render_template('admin/reports.html', **data))
+
+    # Answered with 304 (or from the closed-range cache) when nothing behind the report changed
+    return report_cache.respond(report_type, end_date, render_report)
+
+
+@bp.route('/reports/export')
+@login_required
+def export():
+    import reports
+
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+
+    report_type = request.args.get('type')
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+
+    filename = f"{report_type}_report_{start_date}_to_{end_date}.csv"
+    # Compress on the fly when the client can take it; the browser unpacks it transparently
+    compress = request.accept_encodings['gzip'] > 0
+
+    def build_export():
+        rows = reports.export_rows(report_type, start_date, end_date,
+                                   batch_size=current_app.config['EXPORT_BATCH_SIZE'])
+        chunks = reports.stream_csv(rows, compress=compress,
+                                    chunk_size=current_app.config['EXPORT_CHUNK_SIZE'])
+
+        output = Response(stream_with_context(chunks), mimetype='text/csv')
+        output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        output.headers["Vary"] = "Accept-Encoding"
+        if compress:
+            output.headers["Content-Encoding"] = "gzip"
+        return output
+
+    return report_cache.respond(report_type, end_date, build_export, variant='gzip' if compress else '')
+
+@bp.route('/reports/export/jobs', methods=['POST'])
+@login_required
+def export_job_submit():
+    import export_jobs
+
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+
+    try:
+        start_date = datetime.strptime(request.form.get('start_date', ''), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.form.get('end_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'start_date and end_date (YYYY-MM-DD) are required'}), 400
+
+    try:
+        job = export_jobs.submit(request.form.get('type'), start_date, end_date,
+                                 request.form.get('format', 'csv'))
+    except export_jobs.ExportJobError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(export_job_payload(job)), 202
+
+@bp.route('/reports/export/jobs/<job_id>')
+@login_required
+def export_job_status(job_id):
+    import export_jobs
+
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Permission denied'}), 403
+    job = export_jobs.get_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired export'}), 404
+    return jsonify(export_job_payload(job))
+
+@bp.route('/reports/export/jobs/<job_id>/download')
+@login_required
+def export_job_download(job_id):
+    import export_jobs
+
+    if current_user.role != 'admin':
+        flash('You do not have permission to access this page.')
+        return redirect(url_for('admin.dashboard'))
+    job = export_jobs.get_status(job_id)
+    if job is None or job['state'] != 'done':
+        abort(404)
+    directory, filename = export_jobs.result_path(job)
+    return send_from_directory(directory, filename, as_attachment=True, download_name=job['download_name'])
+
+def export_job_payload(job):
+    payload = {key: job.get(key) for key in ('id', 'state', 'report_type', 'start_date', 'end_date', 'format',
+                                             'rows_written', 'total_rows', 'error')}
+    payload['status_url'] = url_for('reports.export_job_status', job_id=job['id'])
+    if job['state'] == 'done':
+        payload['download_url'] = url_for('reports.export_job_download', job_id=job['id'])
+    return payload
@@ -0,0 +1,250 @@
+"""Set-based queries shared by the HTML reports and the CSV export.
+
+Queries over a date range take their Meal/Payment entity from
+``archive.meal_entity``/``archive.payment_entity``, so ranges that reach
+archived days read the archive tables too.
+"""
+import csv
+import zlib
+from datetime import date, timedelta
+from io import StringIO
+
+from models import db, User, MonthlyCollection
+from ledger import month_key
+import archive
+import attendance_matrix
+import tariffs
+
+
+def meals_marked(meals):
+    """SQL expression counting the meals marked on a row of ``meals`` (Meal or an alias of it)."""
+    return (db.cast(meals.breakfast, db.Integer) +
+            db.cast(meals.lunch, db.Integer) +
+            db.cast(meals.dinner, db.Integer))
+
+
+def dues_query(start_date, end_date, defaulters_only=False):
+    """Per-student dues and payments between two dates, as a single grouped query.
+
+    Each row has ``student_id``, ``name``, ``roll_no``, ``total_due``,
+    ``total_paid`` and ``balance`` (paid minus due). With ``defaulters_only``
+    the query keeps only students whose balance is negative.
+    """
+    meals = archive.meal_entity(start_date)
+    payments = archive.payment_entity(start_date)
+
+    paid = db.session.query(payments.student_id,
+                            db.func.sum(payments.amount).label('total_paid'))\
+                     .filter(payments.date.between(start_date, end_date))\
+                     .group_by(payments.student_id)\
+                     .subquery()
+
+    total_due = db.func.coalesce(db.func.sum(tariffs.meal_price(meals)), 0)
+    total_paid = db.func.coalesce(paid.c.total_paid, 0)
+
+    query = db.session.query(User.id.label('student_id'),
+                             User.name,
+                             User.roll_no,
+                             total_due.label('total_due'),
+                             total_paid.label('total_paid'),
+                             (total_paid - total_due).label('balance'))\
+                      .outerjoin(meals, db.and_(meals.student_id == User.id,
+                                                meals.date.between(start_date, end_date)))\
+                      .outerjoin(paid, paid.c.student_id == User.id)\
+                      .filter(User.role == 'student')\
+                      .group_by(User.id, User.name, User.roll_no, paid.c.total_paid)
+    if defaulters_only:
+        query = query.having(total_paid - total_due < 0)
+    return query
+
+
+def defaulters(start_date, end_date):
+    """Students whose payments in the range do not cover the meals they ate in it."""
+    return dues_query(start_date, end_date, defaulters_only=True).order_by(User.name).all()
+
+
+def attendance_summary(start_date, end_date):
+    """Headcounts and meal rates for a date range, from the attendance matrix.
+
+    The per-student totals are paged separately: see ``summary_student_rows``
+    and ``add_meal_totals``.
+    """
+    matrix = attendance_matrix.get_matrix(start_date, end_date)
+
+    daily = [
+        {'date': day, 'breakfast': int(b), 'lunch': int(l), 'dinner': int(d), 'total': int(b + l + d)}
+        for day, (b, l, d) in zip(matrix.days, matrix.daily_headcounts())
+    ]
+
+    return {
+        'days': daily,
+        'meal_rates': matrix.meal_rates(),
+    }
+
+
+def summary_student_rows():
+    """Students for the attendance summary, as ``(query, keys)`` ordered by name.
+
+    Rows have ``student_id``, ``name``, ``student_name`` (the username when
+    there is no name) and ``roll_no``; a page of them is filled in with
+    ``add_meal_totals``.
+    """
+    query = db.session.query(User.id.label('student_id'), User.name,
+                             db.func.coalesce(db.func.nullif(User.name, ''), User.username).label('student_name'),
+                             User.roll_no)\
+                      .filter(User.role == 'student')
+    return query, [User.name, User.id]
+
+
+def add_meal_totals(rows, start_date, end_date):
+    """Per-student meal totals for some ``summary_student_rows``, from the attendance matrix."""
+    rows = list(rows)
+    matrix = attendance_matrix.get_matrix(start_date, end_date)
+    totals = matrix.meal_totals_for([row.student_id for row in rows])
+    return [
+        {'student_name': row.student_name, 'roll_no': row.roll_no,
+         'breakfast': b, 'lunch': l, 'dinner': d, 'total': b + l + d}
+        for row in rows
+        for b, l, d in [totals[row.student_id]]
+    ]
+
+
+def attendance_rows(start_date, end_date):
+    """Attendance between two dates as plain rows from one JOIN against User.
+
+    Returns ``(query, keys)``. Rows have ``date``, ``student_id``,
+    ``student_name``, ``roll_no``, ``breakfast``, ``lunch``, ``dinner`` and
+    ``total``; no Meal or User objects are built, so nothing lazy-loads per
+    row. ``keys`` order the rows uniquely, for pagination and exports.
+    """
+    meals = archive.meal_entity(start_date)
+    query = db.session.query(meals.date, meals.student_id,
+                             User.name.label('student_name'), User.roll_no,
+                             meals.breakfast, meals.lunch, meals.dinner,
+                             meals_marked(meals).label('total'))\
+                      .join(User, User.id == meals.student_id)\
+                      .filter(meals.date.between(start_date, end_date))
+    return query, [meals.date, meals.student_id]
+
+
+def payment_rows(start_date, end_date):
+    """Payments between two dates as plain rows from one JOIN against User.
+
+    Returns ``(query, keys)``. Rows have ``date``, ``id``, ``student_name``,
+    ``roll_no``, ``amount`` and ``status``.
+    """
+    payments = archive.payment_entity(start_date)
+    query = db.session.query(payments.date, payments.id,
+                             User.name.label('student_name'), User.roll_no,
+                             payments.amount, payments.status)\
+                      .join(User, User.id == payments.student_id)\
+                      .filter(payments.date.between(start_date, end_date))
+    return query, [payments.date, payments.id]
+
+
+def _is_month_aligned(start_date, end_date):
+    # Whole calendar months: starts on the 1st and ends on a month's last day
+    return start_date.day == 1 and (end_date + timedelta(days=1)).day == 1 and start_date <= end_date
+
+
+def monthly_collections(start_date, end_date):
+    """Total collected per month as [{'month': 'October 2026', 'total': ...}], oldest first.
+
+    Whole-month ranges are answered from the MonthlyCollection rollup; any
+    other range is grouped by month in SQL over the matching payments.
+    """
+    if _is_month_aligned(start_date, end_date):
+        rows = db.session.query(MonthlyCollection.month, MonthlyCollection.total_amount)\
+                         .filter(MonthlyCollection.month.between(start_date.strftime('%Y-%m'),
+                                                                 end_date.strftime('%Y-%m')),
+                                 MonthlyCollection.payment_count > 0)\
+                         .order_by(MonthlyCollection.month)\
+                         .all()
+    else:
+        payments = archive.payment_entity(start_date)
+        month = month_key(payments.date)
+        rows = db.session.query(month, db.func.sum(payments.amount))\
+                         .filter(payments.date.between(start_date, end_date))\
+                         .group_by(month)\
+                         .order_by(month)\
+                         .all()
+
+    return [
+        {'month': date(int(month[:4]), int(month[5:7]), 1).strftime('%B %Y'), 'total': total}
+        for month, total in rows
+    ]
+
+
+def export_rows(report_type, start_date, end_date, batch_size=1000):
+    """Yield the CSV rows (header first) for a report, fetching in batches of ``batch_size``."""
+    if report_type == 'attendance':
+        yield ['Date', 'Student Name', 'Roll No', 'Breakfast', 'Lunch', 'Dinner']
+        meals, keys = attendance_rows(start_date, end_date)
+        for meal in meals.order_by(*keys).yield_per(batch_size):
+            yield [
+                meal.date.strftime('%Y-%m-%d'),
+                meal.student_name,
+                meal.roll_no,
+                'Yes' if meal.breakfast else 'No',
+                'Yes' if meal.lunch else 'No',
+                'Yes' if meal.dinner else 'No'
+            ]
+
+    elif report_type == 'defaulters':
+        yield ['Student Name', 'Roll No', 'Total Paid', 'Total Dues', 'Balance']
+        for defaulter in defaulters(start_date, end_date):
+            yield [
+                defaulter.name,
+                defaulter.roll_no,
+                f"Rs. {defaulter.total_paid:.2f}",
+                f"Rs. {defaulter.total_due:.2f}",
+                f"Rs. {defaulter.balance:.2f}"
+            ]
+
+    elif report_type == 'collections':
+        yield ['Month', 'Total Collection']
+        for collection in monthly_collections(start_date, end_date):
+            yield [collection['month'], f"Rs. {collection['total']:.2f}"]
+
+    elif report_type == 'payments':
+        yield ['Date', 'Student Name', 'Roll No', 'Amount', 'Status']
+        payments, keys = payment_rows(start_date, end_date)
+        for payment in payments.order_by(*keys).yield_per(batch_size):
+            yield [
+                payment.date.strftime('%Y-%m-%d'),
+                payment.student_name,
+                payment.roll_no,
+                f"Rs. {payment.amount:.2f}",
+                payment.status
+            ]
+
+
+def stream_csv(rows, compress=False, chunk_size=64 * 1024):
+    """Serialise CSV rows into chunks of roughly ``chunk_size`` bytes, gzipped if asked.
+
+    Only one chunk is ever buffered, so memory stays flat however many rows
+    the report produces.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    # wbits=31 makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            chunk = drain()
+            if chunk:
+                yield chunk
+
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
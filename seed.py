@@ -0,0 +1,100 @@
+"""Seeded generator for realistic test databases.
+
+Builds students, daily attendance and periodic payments with a fixed random
+seed, so the same arguments always give the same database and benchmark
+runs on different commits measure the same data. Rows are bulk inserted in
+batches, then the ledgers, monthly collections and daily headcounts are
+rebuilt from them.
+"""
+import random
+from datetime import date, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Meal, Payment
+from ledger import rebuild_ledgers, rebuild_monthly_collections
+import headcounts
+import tariffs
+
+FIRST_NAMES = ('Aarav', 'Ali', 'Ananya', 'Ayesha', 'Bilal', 'Diya', 'Fatima', 'Hamza', 'Ishaan', 'Kavya',
+               'Meera', 'Omar', 'Priya', 'Rahul', 'Sana', 'Sara', 'Tariq', 'Vikram', 'Zara', 'Zoya')
+LAST_NAMES = ('Ahmed', 'Iyer', 'Khan', 'Kumar', 'Malik', 'Mehta', 'Nair', 'Qureshi', 'Reddy', 'Shah',
+              'Sharma', 'Siddiqui', 'Singh', 'Verma')
+
+# Chance that a present student takes each meal
+MEAL_RATES = {'breakfast': 0.65, 'lunch': 0.85, 'dinner': 0.8}
+ABSENT_RATE = 0.08
+INSERT_BATCH = 5000
+
+STUDENT_PASSWORD = 'student'
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(db.insert(model), rows[start:start + INSERT_BATCH])
+
+
+def generate(students=200, days=90, payment_every=30, seed=42, end_date=None):
+    """Fill an empty database; returns {'students': ..., 'meals': ..., 'payments': ...}.
+
+    Attendance covers ``days`` days ending at ``end_date`` (default
+    yesterday). Every ``payment_every`` days each student pays roughly what
+    they ate since their last payment. All students share the password
+    ``student`` (hashed once) and an ``admin``/``admin`` user is created if
+    missing.
+    """
+    db.create_all()
+    if User.query.filter_by(role='student').first():
+        raise ValueError('The database already has students; seed an empty database')
+
+    rng = random.Random(seed)
+    end_date = end_date or date.today() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+
+    if not User.query.filter_by(username='admin').first():
+        admin = User(username='admin', role='admin')
+        admin.set_password('admin')
+        db.session.add(admin)
+
+    password_hash = generate_password_hash(STUDENT_PASSWORD)
+    _insert(User, [
+        dict(username=f'student{i:05d}', password_hash=password_hash, role='student',
+             name=f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+             roll_no=f'R{i:05d}', room_no=str(100 + i // 2), contact=f'9{rng.randrange(10 ** 9):09d}')
+        for i in range(1, students + 1)
+    ])
+    student_ids = [student_id for (student_id,) in
+                   db.session.query(User.id).filter_by(role='student').order_by(User.id)]
+
+    meals, payments = [], []
+    meal_count = 0
+    for student_id in student_ids:
+        # Some students simply eat more often than others
+        appetite = rng.uniform(0.8, 1.1)
+        unpaid = 0
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            if rng.random() >= ABSENT_RATE:
+                flags = {meal: rng.random() < min(rate * appetite, 1.0) for meal, rate in MEAL_RATES.items()}
+                if any(flags.values()):
+                    meals.append(dict(student_id=student_id, date=day, **flags))
+                    unpaid += sum(tariffs.rate(meal, day) for meal, marked in flags.items() if marked)
+            if payment_every and (offset + 1) % payment_every == 0 and unpaid:
+                # Most pay about what they owe, rounded to 50; a few skip a cycle
+                if rng.random() < 0.9:
+                    amount = max(50, round(unpaid * rng.uniform(0.7, 1.05) / 50) * 50)
+                    payments.append(dict(student_id=student_id, amount=float(amount), date=day, status='paid'))
+                    unpaid = 0
+        if len(meals) >= INSERT_BATCH:
+            _insert(Meal, meals)
+            meal_count += len(meals)
+            meals = []
+    _insert(Meal, meals)
+    _insert(Payment, payments)
+    meal_count += len(meals)
+    db.session.commit()
+
+    rebuild_monthly_collections()
+    headcounts.rebuild()
+    rebuild_ledgers()
+    return {'students': len(student_ids), 'meals': meal_count, 'payments': len(payments)}
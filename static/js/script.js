@@ -1,6 +1,55 @@
 // Toggle meal attendance
 document.addEventListener('DOMContentLoaded', function() {
-    // Meal attendance checkboxes
+    // Meal attendance checkboxes: changes are queued and sent to the bulk endpoint in batches
+    const ATTENDANCE_FLUSH_DELAY = 1500;  // ms after the first queued change
+    const ATTENDANCE_FLUSH_SIZE = 50;     // flush straight away once this many changes are queued
+    const pendingChanges = new Map();     // one entry per checkbox, so re-toggles coalesce
+    let flushTimer = null;
+
+    const flushAttendance = function() {
+        clearTimeout(flushTimer);
+        flushTimer = null;
+        if (pendingChanges.size === 0) {
+            return;
+        }
+
+        const batch = Array.from(pendingChanges.values());
+        pendingChanges.clear();
+
+        fetch('/admin/attendance/bulk', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ changes: batch.map(item => item.change) })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.results) {
+                throw new Error(data.error || 'Unknown error');
+            }
+            const failed = [];
+            data.results.forEach((result, index) => {
+                if (!result.success) {
+                    const item = batch[index];
+                    item.checkbox.checked = item.change.action !== 'mark';
+                    failed.push(result.error);
+                }
+            });
+            if (failed.length) {
+                console.error('Server errors:', failed);
+                alert(`Error updating ${failed.length} attendance entries: ${failed[0]}`);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            batch.forEach(item => {
+                item.checkbox.checked = item.change.action !== 'mark';
+            });
+            alert('Error updating attendance. Please check console for details.');
+        });
+    };
+
     const mealCheckboxes = document.querySelectorAll('.meal-checkbox');
     mealCheckboxes.forEach(checkbox => {
         checkbox.addEventListener('change', function() {
@@ -9,50 +58,127 @@ document.addEventListener('DOMContentLoaded', function() {
             const dateInput = document.getElementById('attendance-date');
             const date = dateInput ? dateInput.value : new Date().toISOString().split('T')[0];
             const action = this.checked ? 'mark' : 'unmark';
-            
-            // Create URL-encoded form data
-            const formData = new URLSearchParams();
-            formData.append('student_id', studentId);
-            formData.append('meal_type', mealType);
-            formData.append('action', action);
-            formData.append('date', date);
-            
-            fetch('/admin/attendance', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                },
-                body: formData.toString()
-            })
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error('Network response was not ok');
+
+            pendingChanges.set(`${studentId}:${date}:${mealType}`, {
+                checkbox: this,
+                change: { student_id: studentId, date: date, meal_type: mealType, action: action }
+            });
+
+            if (pendingChanges.size >= ATTENDANCE_FLUSH_SIZE) {
+                flushAttendance();
+            } else if (!flushTimer) {
+                flushTimer = setTimeout(flushAttendance, ATTENDANCE_FLUSH_DELAY);
+            }
+        });
+    });
+
+    // Live updates: changes committed by any counter (including this one) arrive as server-sent events
+    const headcounts = document.getElementById('headcounts');
+    if (headcounts && window.EventSource) {
+        const events = new EventSource(headcounts.dataset.streamUrl);
+        const dateInput = document.getElementById('attendance-date');
+
+        events.addEventListener('attendance', function(message) {
+            const update = JSON.parse(message.data);
+            update.changes.forEach(change => {
+                // Leave a checkbox alone while this page still has an unsent change for it
+                if (pendingChanges.has(`${change.student_id}:${dateInput.value}:${change.meal_type}`)) {
+                    return;
+                }
+                const checkbox = document.querySelector(
+                    `.meal-checkbox[data-student-id="${change.student_id}"][data-meal-type="${change.meal_type}"]`);
+                if (checkbox) {
+                    checkbox.checked = change.marked;
                 }
-                return response.json();
-            })
-            .then(data => {
-                if (!data.success) {
-                    console.error('Server error:', data.error);
-                    alert('Error updating attendance: ' + (data.error || 'Unknown error'));
-                    this.checked = !this.checked;
+            });
+            Object.entries(update.headcount).forEach(([mealType, delta]) => {
+                const badge = headcounts.querySelector(`.headcount[data-meal-type="${mealType}"]`);
+                if (badge) {
+                    badge.textContent = parseInt(badge.textContent, 10) + delta;
                 }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error updating attendance. Please check console for details.');
-                this.checked = !this.checked;
             });
         });
+
+        // Sent when the events this page missed are no longer kept
+        events.addEventListener('reset', function() {
+            events.close();
+            flushAttendance();
+            window.location.reload();
+        });
+    }
+
+    // Don't lose queued changes when leaving the page
+    window.addEventListener('pagehide', function() {
+        if (pendingChanges.size) {
+            const changes = Array.from(pendingChanges.values()).map(item => item.change);
+            pendingChanges.clear();
+            navigator.sendBeacon('/admin/attendance/bulk',
+                new Blob([JSON.stringify({ changes: changes })], { type: 'application/json' }));
+        }
     });
     
     // Date picker for attendance
     const attendanceDate = document.getElementById('attendance-date');
     if (attendanceDate) {
         attendanceDate.addEventListener('change', function() {
+            flushAttendance();
             window.location.href = `/admin/attendance?date=${this.value}`;
         });
     }
     
+    // Dashboard headcount chart: history from the daily rollup, then the forecast as dashed lines
+    const trendData = document.getElementById('headcount-trend');
+    const trendCanvas = document.getElementById('headcount-chart');
+    if (trendData && trendCanvas && window.Chart) {
+        const meals = [['breakfast', 'Breakfast', '#0d6efd'], ['lunch', 'Lunch', '#198754'], ['dinner', 'Dinner', '#0dcaf0']];
+        let chart = null;
+
+        const drawTrend = function(trend) {
+            const history = trend.history;
+            const labels = history.map(day => day.date).concat(trend.forecast.map(day => day.date));
+            const datasets = [];
+            meals.forEach(([meal, label, color]) => {
+                datasets.push({
+                    label: label,
+                    data: history.map(day => day[meal]).concat(trend.forecast.map(() => null)),
+                    borderColor: color,
+                    pointRadius: history.length > 90 ? 0 : 2,
+                    tension: 0.2
+                });
+                // Starts at the last actual day so the two lines join
+                datasets.push({
+                    label: `${label} forecast`,
+                    data: history.slice(0, -1).map(() => null)
+                        .concat([history.length ? history[history.length - 1][meal] : null])
+                        .concat(trend.forecast.map(day => day[meal])),
+                    borderColor: color,
+                    borderDash: [6, 4],
+                    pointRadius: 2,
+                    tension: 0.2
+                });
+            });
+            if (chart) {
+                chart.destroy();
+            }
+            chart = new Chart(trendCanvas, {
+                type: 'line',
+                data: { labels: labels, datasets: datasets },
+                options: { interaction: { mode: 'index', intersect: false }, scales: { y: { beginAtZero: true } } }
+            });
+        };
+
+        drawTrend(JSON.parse(trendData.textContent));
+
+        const trendRange = document.getElementById('trend-range');
+        if (trendRange) {
+            trendRange.addEventListener('change', function() {
+                fetch(`/admin/headcounts/forecast?history=${this.value}&days=7`)
+                    .then(response => response.json())
+                    .then(drawTrend);
+            });
+        }
+    }
+
     // Report date filters
     const reportStartDate = document.getElementById('report-start-date');
     const reportEndDate = document.getElementById('report-end-date');
@@ -77,6 +203,52 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // Initial update of the download link
         updateDownloadLink();
+
+        // Long exports run as a background job; poll its status until the file is ready
+        const exportJobBtn = document.getElementById('export-job-btn');
+        const exportJobStatus = document.getElementById('export-job-status');
+        const exportFormat = document.getElementById('export-format');
+
+        const pollExportJob = function(statusUrl) {
+            fetch(statusUrl)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.state === 'done') {
+                        exportJobStatus.innerHTML = `Ready: <a href="${job.download_url}">download ${job.rows_written} rows</a>`;
+                        exportJobBtn.disabled = false;
+                    } else if (job.state === 'failed' || job.error) {
+                        exportJobStatus.textContent = `Export failed: ${job.error}`;
+                        exportJobBtn.disabled = false;
+                    } else {
+                        const total = job.total_rows ? ` of ${job.total_rows}` : '';
+                        exportJobStatus.textContent = `${job.state}: ${job.rows_written}${total} rows`;
+                        setTimeout(() => pollExportJob(statusUrl), 1500);
+                    }
+                });
+        };
+
+        if (exportJobBtn) {
+            exportJobBtn.addEventListener('click', function() {
+                const formData = new FormData();
+                formData.append('type', reportType.value);
+                formData.append('start_date', reportStartDate.value);
+                formData.append('end_date', reportEndDate.value);
+                formData.append('format', exportFormat.value);
+
+                exportJobBtn.disabled = true;
+                exportJobStatus.textContent = 'Queued...';
+                fetch('/admin/reports/export/jobs', { method: 'POST', body: formData })
+                    .then(response => response.json())
+                    .then(job => {
+                        if (job.status_url) {
+                            pollExportJob(job.status_url);
+                        } else {
+                            exportJobStatus.textContent = job.error;
+                            exportJobBtn.disabled = false;
+                        }
+                    });
+            });
+        }
     }
     
     
@@ -0,0 +1,127 @@
+"""Cache for the admin dashboard statistics.
+
+The counters are cheap to keep but expensive to recompute, and several
+admins keep the dashboard open on auto-refresh. Values are stored as JSON
+in a pluggable backend:
+
+* ``memory`` (default): a dict in this worker.
+* ``sqlite``: a small SQLite file shared by every worker on the host, so an
+  invalidation in one worker is seen by all of them.
+
+The whole cache is cleared after any commit that writes meals, payments,
+users, ledgers or headcounts (see ``data_events``), but only in the worker
+that committed. So each entry also records the global data version (see
+``data_versions``) it was computed at, and is only served while that is
+still current: one small query tells any worker whether another one has
+written since. ``DASHBOARD_CACHE_TTL`` bounds how long an entry is kept
+regardless, for changes made outside the app. A generation counter bumped
+on every clear stops a computation that raced with a commit from storing
+its out-of-date result.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+import data_events
+import data_versions
+
+WATCHED_TABLES = ('meal', 'payment', 'user', 'student_ledger', 'daily_headcount')
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._data = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key), self._generation
+
+    def set(self, key, value, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS stats_cache '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stats_generation (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO stats_generation (id, value) VALUES (1, 0)')
+
+    def _connect(self):
+        # A short-lived connection per call keeps this safe across threads and forks
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with self._connect() as conn:
+            generation = conn.execute('SELECT value FROM stats_generation WHERE id = 1').fetchone()[0]
+            row = conn.execute('SELECT value FROM stats_cache WHERE key = ?', (key,)).fetchone()
+        return (row[0] if row else None), generation
+
+    def set(self, key, value, generation):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO stats_cache (key, value, stored_at) '
+                         'SELECT ?, ?, ? FROM stats_generation WHERE id = 1 AND value = ?',
+                         (key, value, time.time(), generation))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM stats_cache')
+            conn.execute('UPDATE stats_generation SET value = value + 1 WHERE id = 1')
+
+
+_backend = None
+_hits = _misses = 0
+
+
+def init_app(app):
+    """Create the backend selected by DASHBOARD_CACHE_BACKEND."""
+    global _backend
+    kind = app.config['DASHBOARD_CACHE_BACKEND']
+    if kind == 'memory':
+        _backend = MemoryBackend()
+    elif kind == 'sqlite':
+        _backend = SQLiteBackend(app.config['DASHBOARD_CACHE_PATH'])
+    else:
+        raise ValueError(f'Unknown DASHBOARD_CACHE_BACKEND: {kind}')
+    data_events.on_commit(invalidate, WATCHED_TABLES)
+
+
+def get_or_compute(key, compute):
+    """Return the cached value for ``key``, or call ``compute()`` and cache its (JSON-able) result."""
+    global _hits, _misses
+    version = data_versions.current()[data_versions.GLOBAL]
+    raw, generation = _backend.get(key)
+    if raw is not None:
+        entry = json.loads(raw)
+        # Another worker may have committed since; its invalidation never reached this one
+        if isinstance(entry, dict) and entry.get('version') == version and \
+                time.time() - entry.get('stored_at', 0) < current_app.config['DASHBOARD_CACHE_TTL']:
+            _hits += 1
+            return entry['value']
+    _misses += 1
+    value = compute()
+    # Skipped if a commit invalidated the cache while we were computing
+    _backend.set(key, json.dumps({'version': version, 'stored_at': time.time(), 'value': value}), generation)
+    return value
+
+
+def invalidate(changed_tables=None):
+    _backend.clear()
+
+
+def stats():
+    return {'backend': current_app.config['DASHBOARD_CACHE_BACKEND'], 'hits': _hits, 'misses': _misses}
@@ -0,0 +1,144 @@
+"""Bulk student onboarding from a CSV upload.
+
+Creating students one form POST at a time costs a password hash and a
+commit each. Here the whole file is validated up front (including one
+query per column for usernames and roll numbers already taken), passwords
+are hashed in a process pool, and rows are inserted in batched
+transactions. The caller gets one result per CSV row.
+"""
+import csv
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+
+from models import db, User, StudentLedger
+
+COLUMNS = ('username', 'name', 'roll_no', 'room_no', 'contact', 'password')
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_CHUNK = 500
+
+
+class CSVImportError(ValueError):
+    """The upload as a whole cannot be imported (bad header, too many rows...)."""
+
+
+def _existing(column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[i:i + LOOKUP_CHUNK]
+        found.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)))
+    return found
+
+
+def _ids_for(usernames):
+    ids = []
+    for i in range(0, len(usernames), LOOKUP_CHUNK):
+        chunk = usernames[i:i + LOOKUP_CHUNK]
+        ids.extend(user_id for (user_id,) in db.session.query(User.id).filter(User.username.in_(chunk)))
+    return ids
+
+
+def read_rows(stream, max_rows):
+    """Parse the uploaded CSV into a list of (line number, row dict)."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    rows = []
+    try:
+        header = [name.strip() for name in (reader.fieldnames or [])]
+        missing = [column for column in COLUMNS if column not in header]
+        if missing:
+            raise CSVImportError(f"CSV is missing columns: {', '.join(missing)}")
+        reader.fieldnames = header
+
+        for row in reader:
+            if len(rows) >= max_rows:
+                raise CSVImportError(f'CSV has more than {max_rows} rows')
+            rows.append((reader.line_num, {column: (row.get(column) or '').strip() for column in COLUMNS}))
+    except UnicodeDecodeError:
+        raise CSVImportError('CSV is not UTF-8 text; save it as "CSV UTF-8" and upload it again')
+    except csv.Error as e:
+        raise CSVImportError(f'CSV could not be read at line {reader.line_num}: {e}')
+    return rows
+
+
+def validate(rows):
+    """Return {line: error} for rows that cannot be imported."""
+    errors = {}
+    seen_usernames, seen_roll_nos = {}, {}
+    for line, row in rows:
+        empty = [column for column in COLUMNS if not row[column]]
+        if empty:
+            errors[line] = f"Missing {', '.join(empty)}"
+        elif row['username'] in seen_usernames:
+            errors[line] = f"Username repeats line {seen_usernames[row['username']]}"
+        elif row['roll_no'] in seen_roll_nos:
+            errors[line] = f"Roll number repeats line {seen_roll_nos[row['roll_no']]}"
+        seen_usernames.setdefault(row['username'], line)
+        seen_roll_nos.setdefault(row['roll_no'], line)
+
+    # One pass against the database for everything still valid
+    candidates = [(line, row) for line, row in rows if line not in errors]
+    taken_usernames = _existing(User.username, {row['username'] for _, row in candidates})
+    taken_roll_nos = _existing(User.roll_no, {row['roll_no'] for _, row in candidates})
+    for line, row in candidates:
+        if row['username'] in taken_usernames:
+            errors[line] = 'Username already exists'
+        elif row['roll_no'] in taken_roll_nos:
+            errors[line] = 'Roll number already exists'
+    return errors
+
+
+def hash_passwords(passwords, workers):
+    """Hash passwords in parallel processes (hashing is deliberately CPU-bound)."""
+    if workers <= 1 or len(passwords) < 2:
+        return [generate_password_hash(password) for password in passwords]
+    # spawn, not fork: the web worker holds threads and open database connections
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        chunksize = max(1, len(passwords) // (workers * 4))
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+def import_students(stream, batch_size=500, workers=1, max_rows=5000):
+    """Import students from a CSV stream; returns one result dict per row."""
+    rows = read_rows(stream, max_rows)
+    errors = validate(rows)
+
+    valid = [(line, row) for line, row in rows if line not in errors]
+    hashes = hash_passwords([row['password'] for _, row in valid], workers)
+
+    results = {line: {'line': line, 'username': row['username'], 'success': False, 'error': errors[line]}
+               for line, row in rows if line in errors}
+
+    for start in range(0, len(valid), batch_size):
+        batch = valid[start:start + batch_size]
+        batch_hashes = hashes[start:start + batch_size]
+        try:
+            db.session.execute(db.insert(User), [
+                dict(username=row['username'], password_hash=password_hash, role='student',
+                     name=row['name'], roll_no=row['roll_no'], room_no=row['room_no'],
+                     contact=row['contact'])
+                for (_, row), password_hash in zip(batch, batch_hashes)
+            ])
+            new_ids = _ids_for([row['username'] for _, row in batch])
+            now = datetime.utcnow()
+            db.session.execute(db.insert(StudentLedger), [
+                dict(student_id=user_id, meals_consumed=0, total_due=0, total_paid=0,
+                     balance=0, last_updated=now)
+                for user_id in new_ids
+            ])
+            db.session.commit()
+            for line, row in batch:
+                results[line] = {'line': line, 'username': row['username'], 'success': True, 'error': None}
+        except Exception as e:
+            db.session.rollback()
+            for line, row in batch:
+                results[line] = {'line': line, 'username': row['username'], 'success': False,
+                                 'error': f'Batch failed: {e.__class__.__name__}'}
+
+    return [results[line] for line, _ in rows]
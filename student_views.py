@@ -0,0 +1,94 @@
+"""Student pages: dashboard, attendance history, payments and profile."""
+from datetime import datetime, date, timedelta
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask_login import login_required, current_user
+
+from models import db, User, Meal, StudentLedger
+from ledger import calculate_balance
+from user_cache import user_cache
+import archive
+
+bp = Blueprint('student', __name__, url_prefix='/student')
+
+
+@bp.route('/dashboard')
+@login_required
+def dashboard():
+    if current_user.role != 'student':
+        return redirect(url_for('admin.dashboard'))
+
+    # Get today's meal status
+    today_meal = Meal.query.filter_by(student_id=current_user.id, date=date.today()).first()
+    
+    # Financial balance for the student comes from the ledger; fall back to a full scan if it was never built
+    ledger = db.session.get(StudentLedger, current_user.id)
+    if ledger:
+        total_due, total_paid, balance = ledger.total_due, ledger.total_paid, ledger.balance
+    else:
+        total_due, total_paid, balance = calculate_balance(current_user.id)
+
+    # Get recent meals for the table
+    recent_meals = Meal.query.filter_by(student_id=current_user.id).order_by(Meal.date.desc()).limit(10).all()
+
+    return render_template('student/dashboard.html',
+                           today_meal=today_meal,
+                           total_due=total_due,
+                           total_paid=total_paid,
+                           balance=balance,
+                           recent_meals=recent_meals)
+
+
+@bp.route('/attendance')
+@login_required
+def attendance():
+    if current_user.role == 'admin':
+        return redirect(url_for('admin.dashboard'))
+    
+    start_date = request.args.get('start_date', (date.today() - timedelta(days=30)).isoformat())
+    end_date = request.args.get('end_date', date.today().isoformat())
+    
+    try:
+        meals = archive.meal_entity(datetime.strptime(start_date, '%Y-%m-%d').date())
+    except ValueError:
+        meals = archive.meal_entity()
+    meals = db.session.query(meals).filter(meals.student_id == current_user.id)\
+                                   .filter(meals.date.between(start_date, end_date)).all()
+    
+    return render_template('student/attendance.html', meals=meals, start_date=start_date, end_date=end_date)
+
+@bp.route('/payments')
+@login_required
+def payments():
+    if current_user.role == 'admin':
+        return redirect(url_for('admin.dashboard'))
+    
+    payments = archive.payment_entity()
+    payments = db.session.query(payments).filter(payments.student_id == current_user.id).all()
+    
+    return render_template('student/payments.html', payments=payments)
+
+@bp.route('/profile', methods=['GET', 'POST'])
+@login_required
+def profile():
+    if current_user.role == 'admin':
+        return redirect(url_for('admin.dashboard'))
+    
+    if request.method == 'POST':
+        # current_user is a cached read-only record, so edit the real row
+        user = db.session.get(User, current_user.id)
+        user.name = request.form['name']
+        user.roll_no = request.form['roll_no']
+        user.room_no = request.form['room_no']
+        user.contact = request.form['contact']
+        
+        password = request.form['password']
+        if password:
+            user.set_password(password)
+        
+        db.session.commit()
+        user_cache.invalidate(user.id)
+        flash('Profile updated successfully')
+        return redirect(url_for('student.profile'))
+    
+    return render_template('student/profile.html')
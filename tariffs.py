@@ -0,0 +1,125 @@
+"""Date-effective meal rates and the pricing used by every dues calculation.
+
+Each ``Tariff`` row sets the rate of one meal type from its
+``effective_from`` date until the next row for that meal. Days before the
+first row for a meal are charged ``MEAL_COST``, so a database without
+tariffs prices meals exactly as before.
+
+Balances, the ledger, checkpoints and the dues reports all price meals with
+``meal_price``. That is a SQL expression with one ``CASE`` per meal type over
+the rate intervals, so a grouped ``SUM`` prices any number of rows and
+intervals in the same single query. Single changes (one checkbox) use
+``rate``.
+
+The intervals are cached per worker together with the tariff data version
+(see ``data_versions``) they were loaded at. Every commit that writes the
+tariff table bumps that version, so each worker reloads its copy on its
+next price once any worker has changed a rate; the commit also clears the
+committing worker's copy at once. ``TARIFF_CACHE_SECONDS`` bounds how long a
+copy is kept regardless, for changes made outside the app.
+"""
+import bisect
+import hashlib
+import threading
+import time
+
+from flask import current_app
+
+from models import db, Tariff
+import archive
+import data_events
+import data_versions
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+
+_cache = {'intervals': None, 'version': None, 'loaded_at': 0.0}
+_lock = threading.Lock()
+
+
+def _load():
+    intervals = {meal_type: [] for meal_type in MEAL_TYPES}
+    for meal_type, effective_from, rate in db.session.query(Tariff.meal_type, Tariff.effective_from, Tariff.rate)\
+                                                     .order_by(Tariff.meal_type, Tariff.effective_from):
+        intervals[meal_type].append((effective_from, rate))
+    return intervals
+
+
+def intervals():
+    """{meal_type: [(effective_from, rate), ...]} in date order, from the cache."""
+    version = data_versions.current(('tariff',))['tariff']
+    with _lock:
+        cached = _cache['intervals']
+        if cached is not None and _cache['version'] == version and \
+                time.monotonic() - _cache['loaded_at'] < current_app.config['TARIFF_CACHE_SECONDS']:
+            return cached
+    loaded = _load()
+    with _lock:
+        _cache.update(intervals=loaded, version=version, loaded_at=time.monotonic())
+    return loaded
+
+
+def invalidate(changed_tables=None):
+    with _lock:
+        _cache['intervals'] = None
+
+
+def rate(meal_type, day):
+    """Rate of one ``meal_type`` eaten on ``day``."""
+    history = intervals()[meal_type]
+    index = bisect.bisect_right([effective_from for effective_from, _ in history], day)
+    return history[index - 1][1] if index else current_app.config['MEAL_COST']
+
+
+def meal_price(meals):
+    """SQL expression pricing the meals marked on a row of ``meals`` (Meal or an alias of it)."""
+    default = current_app.config['MEAL_COST']
+    price = None
+    for meal_type, history in intervals().items():
+        if history:
+            # Latest interval first, so the first matching WHEN wins
+            meal_rate = db.case(*((meals.date >= effective_from, rate) for effective_from, rate in reversed(history)),
+                                else_=default)
+        else:
+            meal_rate = db.literal(default)
+        term = db.cast(getattr(meals, meal_type), db.Integer) * meal_rate
+        price = term if price is None else price + term
+    return price
+
+
+def fingerprint():
+    """Short hash of the rates in force, for cache keys of priced output."""
+    digest = hashlib.sha1(str(current_app.config['MEAL_COST']).encode())
+    for meal_type, history in sorted(intervals().items()):
+        for effective_from, meal_rate in history:
+            digest.update(f'{meal_type}:{effective_from}:{meal_rate}'.encode())
+    return digest.hexdigest()[:12]
+
+
+def set_rate(meal_type, meal_rate, effective_from):
+    """Charge ``meal_rate`` for ``meal_type`` from ``effective_from`` on; replaces a rate set for the same day.
+
+    Days closed by a balance checkpoint keep the rates they were closed with.
+    The caller commits, normally after rebuilding the ledgers, since the new
+    rate may reprice meals already recorded.
+    """
+    if meal_type not in MEAL_TYPES:
+        raise ValueError(f'Unknown meal type: {meal_type}')
+    if meal_rate < 0:
+        raise ValueError('Rate cannot be negative')
+    closed = archive.closed_through()
+    if closed is not None and effective_from <= closed:
+        raise ValueError(f'Days up to {closed} are closed; the rate must take effect after that')
+
+    tariff = Tariff.query.filter_by(meal_type=meal_type, effective_from=effective_from).first()
+    if tariff is None:
+        tariff = Tariff(meal_type=meal_type, effective_from=effective_from)
+        db.session.add(tariff)
+    tariff.rate = meal_rate
+    db.session.flush()
+    # Prices computed in the rest of this transaction must see the new rate
+    invalidate()
+    return tariff
+
+
+def init_app(app):
+    data_events.on_commit(invalidate, ('tariff',))
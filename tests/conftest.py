@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from models import db
+import attendance_matrix
+import seed
+import tariffs
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        ATTENDANCE_EVENTS_BACKEND = 'memory'
+        DASHBOARD_CACHE_BACKEND = 'memory'
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        # Per-process caches outlive the previous test's database
+        tariffs.invalidate()
+        attendance_matrix.invalidate()
+        seed.generate(students=12, days=40, payment_every=7, seed=7)
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    return client
@@ -0,0 +1,118 @@
+"""The incremental rollups (StudentLedger, MonthlyCollection, DailyHeadcount)
+must always equal a full recompute from the meal and payment tables."""
+import random
+from datetime import date, timedelta
+
+from models import db, User, MonthlyCollection
+from ledger import verify_ledgers, month_key
+import archive
+import attendance
+import headcounts
+
+MEAL_TYPES = ('breakfast', 'lunch', 'dinner')
+
+
+def expected_collections():
+    payments = archive.payment_entity()
+    month = month_key(payments.date)
+    return {month_value: (round(total, 2), count)
+            for month_value, total, count in db.session.query(month, db.func.sum(payments.amount),
+                                                              db.func.count(payments.id))
+                                                       .group_by(month)}
+
+
+def assert_rollups_match():
+    assert verify_ledgers() == []
+    assert headcounts.verify() == []
+    stored = {row.month: (round(row.total_amount, 2), row.payment_count)
+              for row in MonthlyCollection.query if row.payment_count}
+    assert stored == expected_collections()
+
+
+def student_ids():
+    return [student_id for (student_id,) in db.session.query(User.id).filter_by(role='student').order_by(User.id)]
+
+
+def random_changes(rng, ids, days, count):
+    return [{'student_id': rng.choice(ids), 'date': rng.choice(days).isoformat(),
+             'meal_type': rng.choice(MEAL_TYPES), 'action': rng.choice(('mark', 'unmark'))}
+            for _ in range(count)]
+
+
+def recent_days(first_offset=0, count=10):
+    return [date.today() - timedelta(days=offset) for offset in range(first_offset, first_offset + count)]
+
+
+def test_seeded_database_is_consistent(app):
+    assert_rollups_match()
+
+
+def test_single_and_batched_toggles(app):
+    rng = random.Random(1)
+    ids, days = student_ids(), recent_days()
+    for _ in range(30):
+        [result] = attendance.apply_changes(random_changes(rng, ids, days, 1))
+        assert result['success']
+    for _ in range(5):
+        # Batches repeat the same meal, so only the last change for each one counts
+        results = attendance.apply_changes(random_changes(rng, ids, days[:3], 40))
+        assert all(result['success'] for result in results)
+    assert_rollups_match()
+
+
+def test_rejected_changes_leave_rollups_alone(app):
+    results = attendance.apply_changes([
+        {'student_id': 999999, 'date': date.today().isoformat(), 'meal_type': 'lunch', 'action': 'mark'},
+        {'student_id': student_ids()[0], 'date': date.today().isoformat(), 'meal_type': 'snack', 'action': 'mark'},
+    ])
+    assert not any(result['success'] for result in results)
+    assert_rollups_match()
+
+
+def test_payments(admin):
+    month = date.today().strftime('%Y-%m')
+    before = expected_collections().get(month, (0, 0))[1]
+    for roll_no, amount in (('R00001', '150'), ('R00002', '99.5'), ('R00001', '20')):
+        admin.post('/admin/payments', data={'roll_no': roll_no, 'amount': amount})
+    assert expected_collections()[month][1] == before + 3
+    assert_rollups_match()
+
+
+def test_tariff_change_reprices_and_later_toggles_use_it(admin):
+    effective_from = date.today() - timedelta(days=15)
+    admin.post('/admin/tariffs', data={'meal_type': 'lunch', 'rate': '95', 'effective_from': effective_from.isoformat()})
+    assert_rollups_match()
+
+    rng = random.Random(2)
+    ids = student_ids()
+    # Toggles on both sides of the new rate's start
+    attendance.apply_changes(random_changes(rng, ids, recent_days(10, 10), 40))
+    attendance.apply_changes(random_changes(rng, ids, recent_days(), 40))
+    assert_rollups_match()
+
+
+def test_archiving(app):
+    rng = random.Random(3)
+    ids = student_ids()
+    attendance.apply_changes(random_changes(rng, ids, recent_days(20, 10), 30))
+    archive.create_checkpoint(date.today() - timedelta(days=20))
+    archive.archive_closed_rows()
+    assert_rollups_match()
+
+    # Closed days reject changes; open ones keep the rollups moving
+    closed = attendance.apply_changes(random_changes(rng, ids, recent_days(21, 5), 5))
+    assert not any(result['success'] for result in closed)
+    attendance.apply_changes(random_changes(rng, ids, recent_days(0, 15), 40))
+    assert_rollups_match()
+
+
+def test_student_deletion(admin):
+    archive.create_checkpoint(date.today() - timedelta(days=20))
+    archive.archive_closed_rows()
+    admin.post('/admin/payments', data={'roll_no': 'R00003', 'amount': '75'})
+
+    student = User.query.filter_by(roll_no='R00003').one()
+    admin.post('/admin/students', data={'delete': '1', 'student_id': student.id})
+    db.session.expire_all()
+    assert db.session.get(User, student.id) is None
+    assert_rollups_match()
@@ -0,0 +1,104 @@
+"""In-process LRU/TTL cache behind Flask-Login's user loader.
+
+Every authenticated request needs ``current_user``; without a cache that is
+one ``User`` query per request, including every AJAX attendance toggle. The
+cache keeps small read-only ``CachedUser`` records rather than ORM objects,
+so they can be shared between requests safely. Entries are dropped
+explicitly when a user is edited or deleted in this worker; the TTL bounds
+how long other workers can serve a stale record.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+from models import db, User
+
+CACHED_FIELDS = ('id', 'username', 'role', 'name', 'roll_no', 'room_no', 'contact')
+
+
+class CachedUser(UserMixin):
+    """Detached snapshot of the User fields that views and templates read."""
+
+    def __init__(self, id, username, role, name, roll_no, room_no, contact):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.name = name
+        self.roll_no = roll_no
+        self.room_no = room_no
+        self.contact = contact
+
+    def __repr__(self):
+        return f'<CachedUser {self.id} {self.username}>'
+
+
+class UserCache:
+    def __init__(self, maxsize=4096, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, user_id):
+        """Return the CachedUser for ``user_id``, loading it from the database on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[user_id]
+                self.expirations += 1
+            self.misses += 1
+
+        row = db.session.query(*(getattr(User, field) for field in CACHED_FIELDS))\
+                        .filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+
+        with self._lock:
+            self._entries[user_id] = (now, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(int(user_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+user_cache = UserCache()